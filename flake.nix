@@ -19,7 +19,8 @@
               python-pkgs.tqdm
               python-pkgs.pyyaml
               python-pkgs.openai
-              python-pkgs.ffmpeg-python
+              python-pkgs.av
+              python-pkgs.numpy
               python-pkgs.pyaudio
               python-pkgs.soundfile
               python-pkgs.desktop-notifier
@@ -29,6 +30,9 @@
               python-pkgs.pillow
               python-pkgs.rich
               python-pkgs.xdg-base-dirs
+              python-pkgs.websockets
+              # gtts-cli, the default announcement_tts_command
+              python-pkgs.gtts
             ]))
             pkgs.dzen2
             pkgs.xdotool
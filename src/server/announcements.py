@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Set, Tuple
+
+import numpy as np
+import pyaudio
+import soundfile as sf
+
+from audio_decoding import decode_pcm_blocks
+
+# Extra time excluded from the recording around an announcement, for the reverb of the room.
+playback_margin = 0.05
+
+
+class Announcer:
+    """
+    Voice announcements like "Stop" or "Pause", played in-process.
+
+    Every clip is synthesized once with the configured text to speech command and cached
+    on disk and in memory. Clips are played by a player thread through an output stream
+    that stays open, so an announcement starts without spawning a process. The time
+    window of every playback is recorded, such that the capture can cut exactly that
+    window out of the recording.
+
+    @param get_tts_command: returns the command as a list, in which {text} and {path}
+        are replaced with the text and the file the audio should be written to
+    """
+    def __init__(self, cache_dir: Path, get_tts_command: Callable[[], List[str]], rate: int = 44100):
+        self.cache_dir = cache_dir
+        self.get_tts_command = get_tts_command
+        self.rate = rate
+        self.clips: Dict[str, np.ndarray] = {}
+        self.windows: List[Tuple[float, float]] = []
+        self.prepared: Set[str] = set()
+        self.lock = threading.Lock()
+        self.pending: queue.Queue = queue.Queue()
+        self.p = None
+        self.stream = None
+        self.player = None
+
+    def _cache_path(self, text: str) -> Path:
+        key = hashlib.sha1(repr((text, self.get_tts_command(), self.rate)).encode()).hexdigest()[:16]
+        return self.cache_dir / f'{key}.wav'
+
+    def clip(self, text: str) -> np.ndarray:
+        """@return: the announcement as 16 bit mono PCM, synthesizing it if it is not cached"""
+        cache_path = self._cache_path(text)
+        if cache_path not in self.clips:
+            if not cache_path.exists():
+                self._synthesize(text, cache_path)
+            self.clips[cache_path] = sf.read(cache_path, dtype='int16')[0]
+        return self.clips[cache_path]
+
+    def _synthesize(self, text: str, cache_path: Path):
+        logging.debug(f'Synthesizing announcement "{text}"')
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tts_path = Path(tmp_dir) / 'tts.mp3'
+            command = [arg.format(text=text, path=tts_path) for arg in self.get_tts_command()]
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            samples = np.concatenate(list(decode_pcm_blocks(tts_path, self.rate)))
+        # Write and rename, such that an interrupted write never leaves a broken clip in the cache.
+        fd, tmp_path = tempfile.mkstemp(suffix='.wav', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            sf.write(tmp_path, samples, self.rate)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def prepare(self, texts: List[str]):
+        """Synthesize the given announcements in the background, so the first use has no delay.
+        Announcements that were prepared before are skipped."""
+        with self.lock:
+            texts = [t for t in texts if t not in self.prepared]
+            self.prepared.update(texts)
+        if not texts:
+            return
+        def run():
+            for text in texts:
+                try:
+                    self.clip(text)
+                except Exception as e:
+                    logging.warning(f'Could not synthesize announcement "{text}": {e}')
+        threading.Thread(target=run, name='announcement-synthesis', daemon=True).start()
+
+    def speak(self, text: str):
+        with self.lock:
+            if self.player is None:
+                self.p = pyaudio.PyAudio()
+                self.stream = self.p.open(format=pyaudio.paInt16, channels=1, rate=self.rate, output=True)
+                self.player = threading.Thread(target=self._play, name='announcement-player', daemon=True)
+                self.player.start()
+        self.pending.put(text)
+
+    def _play(self):
+        while True:
+            text = self.pending.get()
+            try:
+                samples = self.clip(text)
+            except Exception as e:
+                logging.warning(f'Could not synthesize announcement "{text}": {e}')
+                continue
+            start = time.monotonic() + self.stream.get_output_latency() # type: ignore
+            with self.lock:
+                self.windows = [w for w in self.windows if w[1] > time.monotonic() - 60]
+                self.windows.append((start - playback_margin, start + len(samples) / self.rate + playback_margin))
+            self.stream.write(samples.tobytes()) # type: ignore
+
+    def playback_windows(self, start: float, end: float) -> List[Tuple[float, float]]:
+        """@return: the playback windows that overlap the time between start and end"""
+        with self.lock:
+            return [w for w in self.windows if w[0] < end and w[1] > start]
+
+    def close(self):
+        if self.stream:
+            self.stream.close()
+            self.p.terminate() # type: ignore
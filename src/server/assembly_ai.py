@@ -1,83 +1,158 @@
 import asyncio
 import base64
 import json
+import logging
 import os
-from pathlib import Path
-import pyaudio
-import websockets
-import yaml
-
-project_path = Path(os.path.dirname(__file__)).absolute()
-
-FRAMES_PER_BUFFER = 3200
-FORMAT = pyaudio.paInt16
-CHANNELS = 1
-RATE = 16000
-p = pyaudio.PyAudio()
- 
-# starts recording
-stream = p.open(
-   format=FORMAT,
-   channels=CHANNELS,
-   rate=RATE,
-   input=True,
-   frames_per_buffer=FRAMES_PER_BUFFER
-)
- 
-assembly_ai_api_key = yaml.safe_load(open(project_path / 'api_keys.yaml'))['assembly_ai']
-
-# the AssemblyAI endpoint we're going to hit
-URL = "wss://api.assemblyai.com/v2/realtime/ws?sample_rate=16000"
- 
-async def send_receive():
-   print(f'Connecting websocket to url ${URL}')
-   async with websockets.connect(
-       URL,
-       extra_headers=(("Authorization", assembly_ai_api_key),),
-       ping_interval=5,
-       ping_timeout=20
-   ) as _ws:
-       await asyncio.sleep(0.1)
-       print("Receiving SessionBegins ...")
-       session_begins = await _ws.recv()
-       print(session_begins)
-       print("Sending messages ...")
-       async def send():
-           while True:
-               try:
-                   data = stream.read(FRAMES_PER_BUFFER)
-                   data = base64.b64encode(data).decode("utf-8")
-                   json_data = json.dumps({"audio_data":str(data)})
-                   await _ws.send(json_data)
-               except websockets.exceptions.ConnectionClosedError as e:
-                   print(e)
-                   assert e.code == 4008
-                   break
-               except Exception as e:
-                   assert False, "Not a websocket 4008 error"
-               await asyncio.sleep(0.01)
-          
-           return True
-
-       async def receive():
-           active_timestamp = 0
-           prev_text = ""
-           while True:
-               try:
-                   result_str = await _ws.recv()
-                   res = json.loads(result_str)
-                   if int(res['audio_start']) > active_timestamp:
-                       print(prev_text)
-                       active_timestamp = res['audio_start']
-                       print()
-                   prev_text = res['text']
-               except websockets.exceptions.ConnectionClosedError as e:
-                   print(e)
-                   assert e.code == 4008
-                   break
-               except Exception as e:
-                   assert False, "Not a websocket 4008 error"
-      
-       send_result, receive_result = await asyncio.gather(send(), receive())
-
-asyncio.run(send_receive())
\ No newline at end of file
+import threading
+from typing import Callable, Optional
+
+import xdg_base_dirs
+from websockets.asyncio.client import connect as ws_connect
+
+from cancellation import Cancelled
+
+# The AssemblyAI real-time endpoint. The sample rate is appended as a query parameter.
+URL = "wss://api.assemblyai.com/v2/realtime/ws"
+
+# AssemblyAI rejects audio messages shorter than 100 ms, so capture chunks are
+# accumulated until at least this much audio is buffered.
+MIN_SEND_SECONDS = 0.1
+
+
+def load_api_key():
+    if 'ASSEMBLYAI_API_KEY' in os.environ:
+        return os.environ['ASSEMBLYAI_API_KEY']
+    api_key_path = xdg_base_dirs.xdg_config_home() / 'system-wide-whisper' / 'assembly_ai_api_key.txt'
+    if api_key_path.exists():
+        return api_key_path.read_text().strip()
+    raise Exception(f"Please put your AssemblyAI API key in {api_key_path} or set ASSEMBLYAI_API_KEY.")
+
+class AssemblyAIStreamer:
+    """
+    Stream audio to the AssemblyAI real-time API while it is being recorded.
+
+    The streamer runs its own asyncio event loop in a background thread. Audio is
+    handed over from the capture loop with feed(), which never blocks. Every phrase that
+    the API marks as final is passed to on_final, in order, on a worker thread, such
+    that slow pasting never stalls sending or receiving.
+    """
+    def __init__(self, api_key: str, sample_rate: int, on_final: Callable[[str], None],
+                 url: str = URL, sample_width: int = 2):
+        self.api_key = api_key
+        self.sample_rate = sample_rate
+        self.on_final = on_final
+        self.url = f"{url}?sample_rate={sample_rate}"
+        self.min_send_bytes = int(MIN_SEND_SECONDS * sample_rate) * sample_width
+        self.final_texts = []
+        self.error: Optional[BaseException] = None
+        self._loop = asyncio.new_event_loop()
+        self._task: Optional[asyncio.Task] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def feed(self, chunk: bytes):
+        """Queue a chunk of raw 16 bit mono PCM audio. Safe to call from any thread."""
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, chunk) # type: ignore
+        except RuntimeError:
+            # The loop is closed because the connection failed. The error is raised in finish.
+            pass
+
+    def finish(self, timeout=10) -> str:
+        """Signal the end of the audio and wait until all final phrases have been delivered.
+        If the session did not terminate within timeout seconds, the connection is closed.
+        @return: all final phrases joined by spaces
+        @raise TimeoutError: if the session did not terminate in time"""
+        self.feed(None) # type: ignore
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self.cancel()
+            raise TimeoutError(f'AssemblyAI did not terminate the session within {timeout}s, '
+                               f'{len(self.final_texts)} final phrases were delivered')
+        if self.error:
+            raise self.error
+        return ' '.join(self.final_texts)
+
+    def cancel(self):
+        """Close the connection immediately, dropping all phrases that were not delivered yet."""
+        try:
+            self._loop.call_soon_threadsafe(lambda: self._task and self._task.cancel())
+        except RuntimeError:
+            pass
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        try:
+            self._task = self._loop.create_task(self._send_receive())
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            self.error = Cancelled()
+        except BaseException as e:
+            logging.exception('Streaming transcription failed')
+            self.error = e
+        finally:
+            self._loop.close()
+
+    async def _send_receive(self):
+        logging.debug(f'Connecting websocket to {self.url}')
+        async with ws_connect(
+            self.url,
+            ping_interval=5,
+            ping_timeout=20,
+            additional_headers=(("Authorization", self.api_key),),
+        ) as ws:
+            session_begins = json.loads(await ws.recv())
+            logging.debug(f'Streaming session begins: {session_begins}')
+            await asyncio.gather(self._send(ws), self._receive(ws))
+
+    async def _send(self, ws):
+        buffer = bytearray()
+        while True:
+            chunk = await self._queue.get() # type: ignore
+            if chunk is not None:
+                buffer += chunk
+            if buffer and (chunk is None or len(buffer) >= self.min_send_bytes):
+                await ws.send(json.dumps({"audio_data": base64.b64encode(buffer).decode("utf-8")}))
+                buffer.clear()
+            if chunk is None:
+                await ws.send(json.dumps({"terminate_session": True}))
+                return
+
+    async def _receive(self, ws):
+        async for message in ws:
+            res = json.loads(message)
+            message_type = res.get('message_type')
+            if message_type == 'FinalTranscript' and res.get('text'):
+                self.final_texts.append(res['text'])
+                await asyncio.to_thread(self.on_final, res['text'])
+            elif message_type == 'SessionTerminated':
+                return
+            elif 'error' in res:
+                raise Exception(f"AssemblyAI error: {res['error']}")
+
+if __name__ == '__main__':
+    # Stream the microphone and print the final phrases, until interrupted.
+    import pyaudio
+
+    FRAMES_PER_BUFFER = 3200
+    RATE = 16000
+    p = pyaudio.PyAudio()
+    stream = p.open(format=pyaudio.paInt16, channels=1, rate=RATE, input=True,
+                    frames_per_buffer=FRAMES_PER_BUFFER)
+    streamer = AssemblyAIStreamer(load_api_key(), RATE, print).start()
+    try:
+        while True:
+            streamer.feed(stream.read(FRAMES_PER_BUFFER))
+    except KeyboardInterrupt:
+        streamer.finish()
+    finally:
+        stream.close()
+        p.terminate()
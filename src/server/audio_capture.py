@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pyaudio
+
+
+class AudioCapture:
+    """
+    The microphone input stream, shared by all recording sessions.
+
+    A reader thread reads the stream while at least one subscriber is registered, and
+    hands every chunk to all subscribers. The stream is stopped when the last subscriber
+    unsubscribes, and reopened if the OS closed it in the meantime, or if the input
+    device was changed.
+
+    Every chunk is timestamped by counting the samples read since the stream started.
+    Only the first chunk is timestamped from the time the read returned and the input
+    latency, as a read returns buffered chunks at once when the reader fell behind.
+    Samples that fall into a window returned by excluded_windows(start, end), e.g. the
+    playback of an announcement, are cut out before the chunk is handed on.
+    """
+    def __init__(self, rate=44100, chunk=1024*4, channels=1, sample_format=pyaudio.paInt16,
+                 input_device_index=None):
+        self.rate = rate
+        self.chunk = chunk
+        self.channels = channels
+        self.sample_format = sample_format
+        self.sample_width = pyaudio.get_sample_size(sample_format)
+        self.input_device_index = input_device_index
+        self.device_changed = False
+        self.p = pyaudio.PyAudio()
+        self.stream = self._open()
+        self.subscribers: List[Callable[[bytes], None]] = []
+        self.excluded_windows: Callable[[float, float], List[Tuple[float, float]]] = lambda start, end: []
+        self.lock = threading.Lock()
+        self.reader = None
+
+    def _open(self):
+        return self.p.open(format=self.sample_format,
+                           channels=self.channels,
+                           rate=self.rate,
+                           frames_per_buffer=self.chunk,
+                           input=True,
+                           input_device_index=self.input_device_index,
+                           start=False)
+
+    def set_input_device(self, input_device_index):
+        """Switch the input device. A recording in progress keeps the old device,
+        the stream is reopened when the next recording starts."""
+        with self.lock:
+            self.input_device_index = input_device_index
+            self.device_changed = True
+
+    def _ensure_stream(self):
+        # The OS is sometimes closing the stream, maybe when it is active to long, so we need
+        # to reopen it if it is not active.
+        try:
+            if self.device_changed or not self.stream.is_active():
+                self.device_changed = False
+                self.stream.stop_stream()
+                self.stream.close()
+                self.stream = self._open()
+        except OSError:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.p.terminate()
+            self.p = pyaudio.PyAudio()
+            self.stream = self._open()
+
+    def subscribe(self, callback: Callable[[bytes], None]):
+        with self.lock:
+            self.subscribers.append(callback)
+            if self.reader is None:
+                self._ensure_stream()
+                self.stream.start_stream()
+                self.reader = threading.Thread(target=self._read, name='audio-capture', daemon=True)
+                self.reader.start()
+
+    def unsubscribe(self, callback: Callable[[bytes], None]):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def _read(self):
+        stream_start = None
+        samples_read = 0
+        while True:
+            data = self.stream.read(self.chunk, exception_on_overflow=False)
+            if stream_start is None:
+                stream_start = time.monotonic() - self.stream.get_input_latency() - self.chunk / self.rate
+            start = stream_start + samples_read / self.rate
+            samples_read += self.chunk
+            with self.lock:
+                if not self.subscribers:
+                    self.stream.stop_stream()
+                    self.reader = None
+                    logging.debug('Stopped audio capture')
+                    return
+                subscribers = list(self.subscribers)
+            data = self._exclude(data, start, start + self.chunk / self.rate)
+            if not data:
+                continue
+            for callback in subscribers:
+                callback(data)
+
+    def _exclude(self, data: bytes, start: float, end: float) -> bytes:
+        """Cut the samples that were captured during an excluded window out of the chunk."""
+        windows = self.excluded_windows(start, end)
+        if not windows:
+            return data
+        samples = np.frombuffer(data, dtype=np.int16)
+        keep = np.ones(len(samples), dtype=bool)
+        for window_start, window_end in windows:
+            first = max(0, int((window_start - start) * self.rate))
+            last = min(len(samples), int(np.ceil((window_end - start) * self.rate)))
+            keep[first:last] = False
+        return samples[keep].tobytes()
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
@@ -0,0 +1,128 @@
+import io
+import math
+import queue
+import threading
+from pathlib import Path
+from typing import Container, Iterator, Optional, Tuple
+
+import av
+import numpy as np
+import soundfile as sf
+
+from cancellation import CancellationToken
+
+# Whisper works on 16 kHz mono internally, so there is no point in uploading more.
+sample_rate = 16000
+# Keeps a segment well below the 25 MB upload limit of the OpenAI API.
+segment_seconds = 60 * 20
+
+
+def decode_pcm_blocks(path: Path, rate: int = sample_rate) -> Iterator[np.ndarray]:
+    """Decode any audio or video file in-process, yielding blocks of 16 bit mono PCM at the given rate,
+    as they come out of the decoder. Downmixing and resampling is done by libswresample."""
+    with av.open(str(path)) as container:
+        for frame in _resampled_frames(container, rate):
+            yield frame.to_ndarray().reshape(-1)
+
+def _resampled_frames(container, rate):
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=rate)
+    for frame in container.decode(audio=0):
+        yield from resampler.resample(frame)
+    yield from resampler.resample(None)
+
+def recompress(source: Path, target: Path, bitrate: int = 16000, rate: int = sample_rate):
+    """Re-encode an audio file to Opus, a codec made for speech at low bitrates."""
+    with av.open(str(source)) as inp, av.open(str(target), 'w', format='ogg') as out:
+        stream = out.add_stream('libopus', rate=rate, layout='mono')
+        stream.bit_rate = bitrate
+        for block in _resampled_frames(inp, rate):
+            for packet in stream.encode(block):
+                out.mux(packet)
+        for packet in stream.encode(None):
+            out.mux(packet)
+
+def estimate_segment_count(path: Path, seconds: int = segment_seconds) -> int:
+    """Estimate the number of segments from the container metadata, without decoding."""
+    with av.open(str(path)) as container:
+        if not container.duration:
+            return 1
+        return max(1, math.ceil(container.duration / av.time_base / seconds))
+
+def encode_segment(samples: np.ndarray, name: str, rate: int = sample_rate) -> io.BytesIO:
+    """Encode PCM samples as an in-memory Ogg Vorbis file that can be uploaded directly."""
+    buf = io.BytesIO()
+    sf.write(buf, samples, rate, format='OGG', subtype='VORBIS')
+    buf.seek(0)
+    # The API uses the file name to detect the format.
+    buf.name = f'{name}.ogg'
+    return buf
+
+def iter_segments(path: Path, skip: Container[int] = (), token: Optional[CancellationToken] = None,
+                  seconds: int = segment_seconds) -> Iterator[Tuple[int, Optional[io.BytesIO]]]:
+    """
+    Cut a file into encoded segments of the given length while decoding it.
+
+    Segments are yielded as soon as they are complete, so the first one can be
+    uploaded while the rest of the file is still being decoded. Segments whose index
+    is in skip are not encoded and yielded as None.
+    @raise Cancelled: if the token is cancelled, which is checked for every decoded block
+    """
+    segment_samples = seconds * sample_rate
+    blocks, buffered, index = [], 0, 0
+
+    def cut(samples):
+        name = f'{path.name}.segment{index:03d}'
+        return index, None if index in skip else encode_segment(samples, name)
+
+    for block in decode_pcm_blocks(path):
+        if token:
+            token.raise_if_cancelled()
+        blocks.append(block)
+        buffered += len(block)
+        if buffered >= segment_samples:
+            samples = np.concatenate(blocks)
+            while len(samples) >= segment_samples:
+                yield cut(samples[:segment_samples])
+                samples = samples[segment_samples:]
+                index += 1
+            blocks, buffered = [samples], len(samples)
+    if buffered or index == 0:
+        yield cut(np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int16))
+
+def prefetch(iterator: Iterator, size: int = 1) -> Iterator:
+    """Run an iterator in a background thread, buffering up to size items ahead of the consumer.
+    Exceptions of the iterator are re-raised in the consumer."""
+    items: queue.Queue = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+        put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # Lets the producer exit if the consumer stops early.
+        stopped.set()
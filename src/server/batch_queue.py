@@ -0,0 +1,188 @@
+import glob
+import json
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from cancellation import Cancelled
+from data_structures import JobState
+
+audio_extensions = {'.mp3', '.wav', '.m4a', '.ogg', '.opus', '.flac', '.webm', '.mp4', '.mkv', '.aac', '.mov'}
+
+
+def _resolve(pattern, working_dir: Path) -> Path:
+    path = Path(pattern).expanduser()
+    return path if path.is_absolute() else working_dir / path
+
+def expand_paths(pattern, working_dir: Path) -> List[Path]:
+    """Expand a directory or glob pattern to a sorted list of audio files.
+    Relative patterns are resolved against working_dir."""
+    path = _resolve(pattern, working_dir)
+    if path.is_dir():
+        candidates = path.rglob('*')
+    else:
+        candidates = (Path(p) for p in glob.glob(str(path), recursive=True))
+    return sorted(p.resolve() for p in candidates if p.is_file() and p.suffix.lower() in audio_extensions)
+
+def is_batch_pattern(pattern, working_dir: Path) -> bool:
+    """Whether a --transcribe-file argument should go through the batch queue. An existing file
+    is never a pattern, also if its name contains glob characters, e.g. "Meeting [2024].mp3"."""
+    path = _resolve(pattern, working_dir)
+    if path.is_file():
+        return False
+    return path.is_dir() or glob.has_magic(str(pattern))
+
+class BatchJob:
+    def __init__(self, path, options, state=JobState.QUEUED, size=None, mtime=None,
+                 segments_done=0, segments_total=0, error=None, started=None, finished=None):
+        self.path = Path(path)
+        self.options = options
+        self.state = state
+        stat = self.path.stat() if size is None else None
+        self.size = stat.st_size if stat else size
+        self.mtime = stat.st_mtime if stat else mtime
+        self.segments_done = segments_done
+        self.segments_total = segments_total
+        self.error = error
+        self.started = started
+        self.finished = finished
+
+    def is_unchanged(self) -> bool:
+        """Whether the file on disk is still the one this job refers to."""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    def to_dict(self):
+        d = dict(vars(self))
+        d['path'] = str(self.path)
+        d['state'] = self.state.name
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        d = dict(d)
+        d['state'] = JobState[d['state']]
+        return cls(**d)
+
+    def __str__(self):
+        progress = f' {self.segments_done}/{self.segments_total} segments' if self.segments_total else ''
+        error = f' ({self.error})' if self.error else ''
+        return f'{self.state.name:8} {self.path}{progress}{error}'
+
+class BatchQueue:
+    """
+    A transcription job queue that is persisted to disk.
+
+    Jobs are processed by a fixed number of worker threads. Every state change is
+    written to queue_file, such that after a restart queued and interrupted jobs are
+    picked up again. Files that were already transcribed, and did not change since,
+    are skipped when they are enqueued again.
+
+    @param transcribe_file: called as transcribe_file(path, options, progress, token), where
+        progress(done, total) reports finished segments. Returns the transcript.
+    @param new_token: creates the cancellation token of a job
+    """
+    def __init__(self, queue_file: Path, transcribe_file: Callable, new_token: Callable, concurrency: int = 1):
+        self.queue_file = queue_file
+        self.transcribe_file = transcribe_file
+        self.new_token = new_token
+        self.concurrency = concurrency
+        self.jobs: Dict[str, BatchJob] = {}
+        self.lock = threading.Lock()
+        self.pending: queue.Queue = queue.Queue()
+        self.workers: List[threading.Thread] = []
+        self._load()
+
+    def _load(self):
+        if not self.queue_file.exists():
+            return
+        try:
+            for d in json.loads(self.queue_file.read_text()):
+                job = BatchJob.from_dict(d)
+                if job.state == JobState.RUNNING:
+                    # The server stopped while the job was running.
+                    job.state = JobState.QUEUED
+                self.jobs[str(job.path)] = job
+        except (ValueError, KeyError, TypeError) as e:
+            corrupt_file = self.queue_file.with_name(self.queue_file.name + '.corrupt')
+            logging.error(f'The batch queue file is corrupt, starting with an empty queue '
+                          f'and moving it to {corrupt_file}: {e!r}')
+            self.queue_file.replace(corrupt_file)
+            self.jobs = {}
+            return
+        resumed = [j for j in self.jobs.values() if j.state == JobState.QUEUED]
+        for job in resumed:
+            self.pending.put(job)
+        if resumed:
+            logging.info(f'Resuming {len(resumed)} batch transcription jobs.')
+
+    def _save(self):
+        """Persist all jobs. The caller must hold self.lock."""
+        tmp_file = self.queue_file.with_suffix('.tmp')
+        tmp_file.write_text(json.dumps([j.to_dict() for j in self.jobs.values()], indent=2))
+        tmp_file.replace(self.queue_file)
+
+    def start(self):
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._worker, name=f'batch-worker-{i}', daemon=True)
+            t.start()
+            self.workers.append(t)
+        return self
+
+    def enqueue(self, paths: List[Path], options) -> str:
+        """Add files to the queue. @return: a summary message for the client"""
+        added, skipped = 0, 0
+        with self.lock:
+            for path in paths:
+                existing = self.jobs.get(str(path))
+                if existing and existing.is_unchanged() and existing.state != JobState.FAILED:
+                    skipped += 1
+                    continue
+                job = BatchJob(path, options)
+                self.jobs[str(path)] = job
+                self.pending.put(job)
+                added += 1
+            self._save()
+        return f"Queued {added} files for transcription, skipped {skipped} already queued or done.\n"
+
+    def _update(self, job, **changes):
+        with self.lock:
+            for k, v in changes.items():
+                setattr(job, k, v)
+            self._save()
+
+    def _worker(self):
+        while True:
+            job = self.pending.get()
+            # The job might have been replaced by a newer enqueue of the same path.
+            if self.jobs.get(str(job.path)) is not job or job.state != JobState.QUEUED:
+                continue
+            self._update(job, state=JobState.RUNNING, started=time.time(), error=None)
+            logging.info(f'Batch transcribing {job.path}')
+            try:
+                self.transcribe_file(job.path, job.options,
+                    lambda done, total: self._update(job, segments_done=done, segments_total=total),
+                    self.new_token())
+                self._update(job, state=JobState.DONE, finished=time.time())
+            except Cancelled:
+                logging.info(f'Batch transcription of {job.path} aborted')
+                self._update(job, state=JobState.FAILED, error='Aborted', finished=time.time())
+            except Exception as e:
+                logging.exception(f'Batch transcription of {job.path} failed')
+                self._update(job, state=JobState.FAILED, error=str(e), finished=time.time())
+
+    def status(self) -> str:
+        with self.lock:
+            jobs = list(self.jobs.values())
+        counts = {s: sum(j.state == s for j in jobs) for s in JobState}
+        msg = "Batch jobs: " + ", ".join(f"{n} {s.name.lower()}" for s, n in counts.items()) + "\n"
+        for job in jobs:
+            if job.state != JobState.DONE:
+                msg += f"  {job}\n"
+        return msg
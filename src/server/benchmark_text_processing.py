@@ -0,0 +1,154 @@
+"""Microbenchmark and golden-output check for the text post-processing.
+
+Runs every transcript in benchmark_data/transcripts.yaml through
+process_transcription, compares the result to benchmark_data/golden.yaml and
+reports the per-call latency and memory allocations per corpus kind.
+
+    python benchmark_text_processing.py                  # check + benchmark
+    python benchmark_text_processing.py --check-only     # only golden outputs
+    python benchmark_text_processing.py --update-golden  # accept current outputs
+"""
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import yaml
+
+from text_processing import process_transcription
+
+benchmark_data_dir = Path(__file__).parent / 'benchmark_data'
+corpus_path = benchmark_data_dir / 'transcripts.yaml'
+golden_path = benchmark_data_dir / 'golden.yaml'
+
+
+def load_corpus():
+    corpus = yaml.safe_load(corpus_path.open())
+    for entry in corpus:
+        entry['text'] = ' '.join([entry['text']] * entry.get('repeat', 1))
+    return corpus
+
+def entry_args(entry):
+    """The subset of the network arguments that process_transcription reads."""
+    return argparse.Namespace(
+        no_postprocessing=entry.get('no_postprocessing', False),
+        start_lowercase=entry.get('start_lowercase', False))
+
+def run_entry(entry):
+    return process_transcription(entry_args(entry), entry['text'])
+
+def check_golden(corpus) -> int:
+    """Compare the outputs against the golden file. @return: number of mismatches"""
+    if not golden_path.exists():
+        print(f'No golden file at {golden_path}, run with --update-golden first.')
+        return len(corpus)
+    golden = yaml.safe_load(golden_path.open())
+    failures = 0
+    for entry in corpus:
+        if entry['id'] not in golden:
+            print(f'MISSING {entry["id"]}: no golden output')
+            failures += 1
+            continue
+        out = run_entry(entry)
+        if out != golden[entry['id']]:
+            print(f'MISMATCH {entry["id"]}:\n  expected: {golden[entry["id"]]!r}\n  got:      {out!r}')
+            failures += 1
+    for id in set(golden) - {e['id'] for e in corpus}:
+        print(f'STALE {id}: golden output without corpus entry')
+    print(f'Golden check: {len(corpus) - failures}/{len(corpus)} outputs match')
+    return failures
+
+def update_golden(corpus):
+    golden = {entry['id']: run_entry(entry) for entry in corpus}
+    with golden_path.open('w') as f:
+        f.write('# Generated by benchmark_text_processing.py --update-golden. Do not edit by hand.\n')
+        yaml.safe_dump(golden, f, allow_unicode=True, sort_keys=True, width=float('inf'), default_style='"')
+    print(f'Wrote {len(golden)} golden outputs to {golden_path}')
+
+def measure_latency(entry, iterations):
+    """@return: list of per-call latencies in microseconds"""
+    args = entry_args(entry)
+    text = entry['text']
+    # Warm up the regex cache so the first call does not dominate.
+    process_transcription(args, text)
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        process_transcription(args, text)
+        latencies.append((time.perf_counter_ns() - start) / 1000)
+    return latencies
+
+def measure_allocations(entry, iterations):
+    """Measure allocations with tracemalloc. This is done separately from the latency
+    measurement because tracing slows down every allocation.
+    @return: (peak bytes per call, allocated blocks per call)"""
+    args = entry_args(entry)
+    text = entry['text']
+    process_transcription(args, text)
+    tracemalloc.start()
+    peaks, blocks = [], []
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        base, _ = tracemalloc.get_traced_memory()
+        process_transcription(args, text)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        peaks.append(peak - base)
+        blocks.append(sum(max(s.count_diff, 0) for s in after.compare_to(before, 'lineno')))
+    tracemalloc.stop()
+    return statistics.median(peaks), statistics.median(blocks)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def benchmark(corpus, iterations, allocation_iterations, verbose):
+    results = {}
+    for entry in corpus:
+        latencies = measure_latency(entry, iterations)
+        peak, blocks = measure_allocations(entry, allocation_iterations)
+        results[entry['id']] = (entry['kind'], len(entry['text']), latencies, peak, blocks)
+
+    header = f'{"":28} {"chars":>7} {"mean us":>10} {"p50 us":>10} {"p95 us":>10} {"peak KiB":>9} {"blocks":>7}'
+    def row(name, chars, latencies, peaks, blocks):
+        return (f'{name:28} {chars:7d} {statistics.fmean(latencies):10.1f} '
+                f'{percentile(latencies, 0.5):10.1f} {percentile(latencies, 0.95):10.1f} '
+                f'{statistics.fmean(peaks) / 1024:9.1f} {statistics.fmean(blocks):7.0f}')
+
+    print(header)
+    for kind in sorted({kind for kind, *_ in results.values()}):
+        rows = [(id, r) for id, r in results.items() if r[0] == kind]
+        if verbose:
+            for id, (_, chars, latencies, peak, blocks) in rows:
+                print(row(f'  {id}', chars, latencies, [peak], [blocks]))
+        print(row(kind,
+                  int(statistics.fmean(r[1] for _, r in rows)),
+                  [l for _, r in rows for l in r[2]],
+                  [r[3] for _, r in rows],
+                  [r[4] for _, r in rows]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark and check the transcription post-processing.')
+    parser.add_argument('--iterations', type=int, default=50,
+        help='Number of timed calls per corpus entry.')
+    parser.add_argument('--allocation-iterations', type=int, default=5,
+        help='Number of traced calls per corpus entry for the allocation measurement.')
+    parser.add_argument('--check-only', action='store_true',
+        help='Only compare the outputs against the golden file.')
+    parser.add_argument('--update-golden', action='store_true',
+        help='Overwrite the golden file with the current outputs.')
+    parser.add_argument('--verbose', action='store_true',
+        help='Report every corpus entry, not only the per kind aggregate.')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    if args.update_golden:
+        update_golden(corpus)
+        sys.exit(0)
+    failures = check_golden(corpus)
+    if not args.check_only:
+        benchmark(corpus, args.iterations, args.allocation_iterations, args.verbose)
+    sys.exit(1 if failures else 0)
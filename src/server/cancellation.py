@@ -0,0 +1,53 @@
+import threading
+from typing import Callable, List
+
+
+class Cancelled(Exception):
+    pass
+
+class CancellationToken:
+    """
+    Carried by a session through recording, encoding, uploading and the API calls.
+
+    Long running steps either poll `cancelled`, or register a callback with on_cancel
+    that interrupts them, e.g. by closing a connection. Cancelling is idempotent.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Register a callback that is called once when the token is cancelled. If the token
+        is already cancelled it is called immediately.
+        @return: a function that unregisters the callback"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return unregister
+        callback()
+        return lambda: None
+
+    def wait(self, timeout=None) -> bool:
+        return self._event.wait(timeout)
@@ -0,0 +1,54 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict
+
+
+class SegmentCheckpoint:
+    """
+    Progress of a segmented file transcription, kept in a file next to the audio file.
+
+    The checkpoint holds the text of every segment that was already transcribed. If the
+    transcription is aborted or crashes, running it again only transcribes the missing
+    segments. The checkpoint is discarded if the source file changed, and removed once
+    the full transcript was assembled.
+    """
+    def __init__(self, source: Path):
+        self.source = source
+        self.file = source.with_name(source.name + '.whisper-checkpoint.json')
+        stat = source.stat()
+        self.fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        self.texts: Dict[int, str] = {}
+        self._load()
+
+    def _load(self):
+        if not self.file.exists():
+            return
+        try:
+            data = json.loads(self.file.read_text())
+        except json.JSONDecodeError:
+            data = {}
+        if data.get('fingerprint') != self.fingerprint:
+            logging.info(f'Discarding stale checkpoint {self.file}')
+            self.discard()
+            return
+        self.texts = {int(i): t for i, t in data['texts'].items()}
+        logging.info(f'Resuming {self.source.name} from checkpoint, '
+                     f'{len(self.texts)} segments already transcribed.')
+
+    def _save(self):
+        tmp_file = self.file.with_suffix('.tmp')
+        tmp_file.write_text(json.dumps(
+            {'fingerprint': self.fingerprint, 'texts': self.texts}, indent=2))
+        tmp_file.replace(self.file)
+
+    def add(self, index: int, text: str):
+        self.texts[index] = text
+        self._save()
+
+    def transcript(self) -> str:
+        return ''.join(self.texts[i] for i in sorted(self.texts))
+
+    def discard(self):
+        self.texts = {}
+        self.file.unlink(missing_ok=True)
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from audio_decoding import decode_pcm_blocks, encode_segment, sample_rate
+from cancellation import Cancelled, CancellationToken
+
+# A segment that overlaps more than one clip by at least this many seconds can't be
+# attributed, and the clips of the batch are transcribed separately instead.
+ambiguous_overlap = 0.2
+
+
+class _Clip:
+    def __init__(self, samples: np.ndarray, token: CancellationToken):
+        self.samples = samples
+        self.token = token
+        self.offset = 0.0
+        self.done = threading.Event()
+        self.text: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / sample_rate
+
+def split_segments(segments: List[dict], spans: List[Tuple[float, float]]) -> Optional[List[str]]:
+    """Attribute every segment to the span it overlaps most, or the nearest one if it lies in the gap.
+    @return: the text of every span, or None if a segment overlaps several spans"""
+    texts: List[List[str]] = [[] for _ in spans]
+    for segment in segments:
+        overlaps = [min(end, segment['end']) - max(start, segment['start']) for start, end in spans]
+        if sum(o >= ambiguous_overlap for o in overlaps) > 1:
+            return None
+        texts[int(np.argmax(overlaps))].append(segment['text'].strip())
+    return [' '.join(t) for t in texts]
+
+class Coalescer:
+    """
+    Joins short clips into one transcription request, to save the request overhead.
+
+    A clip waits until max_wait seconds after the first clip of its batch, or until the
+    batch holds max_batch_seconds of audio. The clips are joined with gap seconds of
+    silence, and transcribed with segment timestamps, which split the text back up
+    between the clips. If a segment spans two clips, or the request fails, every clip
+    is transcribed on its own.
+
+    @param transcribe: called as transcribe(audio, token, response_format) -> response
+    """
+    def __init__(self, transcribe: Callable, get_config: Callable[[], dict]):
+        self.transcribe = transcribe
+        self.get_config = get_config
+        self.lock = threading.Lock()
+        self.pending: List[_Clip] = []
+        self.timer: Optional[threading.Timer] = None
+        self.batches = 0
+        self.coalesced = 0
+
+    def accepts(self, duration: float) -> bool:
+        config = self.get_config()
+        return config['enabled'] and duration <= config['max_clip_seconds']
+
+    def __call__(self, path, token: CancellationToken) -> str:
+        """Transcribe a clip as part of the next batch.
+        @return: the text of the clip
+        @raise Cancelled: if the token is cancelled before the batch was sent"""
+        clip = _Clip(np.concatenate(list(decode_pcm_blocks(path))), token)
+        config = self.get_config()
+        with self.lock:
+            self.pending.append(clip)
+            if sum(c.duration for c in self.pending) >= config['max_batch_seconds']:
+                self._flush_locked()
+            elif self.timer is None:
+                self.timer = threading.Timer(config['max_wait'], self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        unregister = token.on_cancel(clip.done.set)
+        clip.done.wait()
+        unregister()
+        with self.lock:
+            if clip in self.pending:
+                self.pending.remove(clip)
+                raise Cancelled()
+        if clip.error:
+            raise clip.error
+        token.raise_if_cancelled()
+        return clip.text # type: ignore
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            threading.Thread(target=self._run, args=[batch], name='coalesced-transcription', daemon=True).start()
+
+    def _run(self, batch: List[_Clip]):
+        if len(batch) > 1:
+            self._transcribe_joined(batch)
+        for clip in batch:
+            if clip.text is None:
+                try:
+                    clip.text = self.transcribe(encode_segment(clip.samples, 'clip'), clip.token, 'json')['text']
+                except BaseException as e:
+                    clip.error = e
+            clip.done.set()
+
+    def _transcribe_joined(self, batch: List[_Clip]):
+        gap = np.zeros(int(self.get_config()['gap'] * sample_rate), dtype=np.int16)
+        parts = []
+        offset = 0.0
+        for clip in batch:
+            clip.offset = offset
+            parts += [clip.samples, gap]
+            offset += clip.duration + len(gap) / sample_rate
+        # The joined request is only cancelled when all of its clips are.
+        token = CancellationToken()
+        def cancel_if_all_cancelled():
+            if all(c.token.cancelled for c in batch):
+                token.cancel()
+        unregister = [c.token.on_cancel(cancel_if_all_cancelled) for c in batch]
+        start = time.time()
+        try:
+            response = self.transcribe(encode_segment(np.concatenate(parts), 'batch'), token, 'verbose_json')
+        except Cancelled:
+            return
+        except Exception as e:
+            logging.warning(f'Coalesced transcription failed, transcribing the clips separately: {e}')
+            return
+        finally:
+            for u in unregister:
+                u()
+        texts = split_segments(response.get('segments', []), [(c.offset, c.offset + c.duration) for c in batch])
+        if texts is None:
+            logging.info('Could not split the coalesced transcription, transcribing the clips separately')
+            return
+        logging.debug(f'Transcribed {len(batch)} clips in one request in {time.time() - start:.2f}s')
+        for clip, text in zip(batch, texts):
+            clip.text = text
+        with self.lock:
+            self.batches += 1
+            self.coalesced += len(batch)
+
+    def status(self) -> str:
+        with self.lock:
+            return (f"Coalesced transcription: {self.coalesced} clips in {self.batches} requests, "
+                    f"{len(self.pending)} waiting\n")
@@ -1,6 +1,9 @@
 from datetime import datetime
 from pathlib import Path
+import logging
+import threading
 import time
+from typing import Callable, List, Tuple
 
 import yaml
 
@@ -13,14 +16,10 @@ instance_id = datetime.now().strftime("%Y%m%d%H%M%S")
 logs_dir = project_path / 'logs'
 debug_log_path = logs_dir / 'debug.log'
 transcription_file = logs_dir / "whisper_transcriptions.txt"
+batch_queue_file = logs_dir / "batch_queue.json"
 audio_path = project_path / "audio"
-
-# IPC
-ipc_dir = project_path / 'IPC'
-stop_signal_file = ipc_dir / 'stop'
-pause_signal_file = ipc_dir / 'pause'
-running_signal_file = ipc_dir / 'running'
-abort_signal_file = ipc_dir / 'abort'
+announcement_cache_dir = project_path / "cache" / "announcements"
+paste_timings_file = project_path / "cache" / "paste_timings.json"
 
 # Icons
 icon_dir = project_path / 'icons'
@@ -35,11 +34,165 @@ instance_lock_path = lock_path / instance_id
 logs_dir.mkdir(exist_ok=True)
 lock_path.mkdir(exist_ok=True)
 audio_path.mkdir(exist_ok=True)
-ipc_dir.mkdir(exist_ok=True)
 
-config = yaml.load((project_path / 'config.yaml').open(), yaml.FullLoader)
+notifier_systems = ['terminal-notifier', 'tkinter', 'dzen2popup', 'macos-alert', 'no-popup']
+number = (int, float)
+optional = lambda t: (t, type(None))
+
+# The expected type of every config key. A list means one of the listed values, a dict a
+# nested section. Keys that are not listed, e.g. python_path, are not checked.
+config_schema = {
+    'input_language': optional(str),
+    'model': str,
+    'paste_wait': number,
+    'paste_timeout': number,
+    'notifier_system': notifier_systems,
+    'input_device_index': optional(int),
+    'IP': str,
+    'remote_secret': optional(str),
+    'port': int,
+    'debug_port': int,
+    'assembly_ai_url': str,
+    'announcement_tts_command': list,
+    'batch_concurrency': int,
+    'coalescing': {
+        'enabled': bool,
+        'max_clip_seconds': number,
+        'max_batch_seconds': number,
+        'max_wait': number,
+        'gap': number,
+    },
+    'vocabulary_file': optional(str),
+    'auto_stop': {
+        'trailing_silence': number,
+        'min_utterance': number,
+        'threshold_db': number,
+    },
+    'debug_log': {
+        'max_megabytes': number,
+        'backups': int,
+        'json_lines': bool,
+    },
+    'hedging': {
+        'enabled': bool,
+        'percentile': number,
+        'min_samples': int,
+        'default_ratio': number,
+        'secondary_backend': optional(dict),
+    },
+    'audio_retention': {
+        'max_megabytes': number,
+        'max_age_days': number,
+        'recompress_after_hours': number,
+        'recompress_bitrate': int,
+        'throttle_seconds': number,
+    },
+}
+
+def validate(data, schema, prefix='') -> List[str]:
+    """@return: a description of every value that does not match the schema"""
+    errors = []
+    for key, expected in schema.items():
+        name = f'{prefix}{key}'
+        if key not in data:
+            errors.append(f'{name} is missing')
+        elif isinstance(expected, dict):
+            if isinstance(data[key], dict):
+                errors += validate(data[key], expected, f'{name}.')
+            else:
+                errors.append(f'{name} must be a section')
+        elif isinstance(expected, list):
+            if data[key] not in expected:
+                errors.append(f'{name} must be one of {expected}, not {data[key]!r}')
+        elif not isinstance(data[key], expected):
+            errors.append(f'{name} has the wrong type {type(data[key]).__name__}')
+    return errors
+
+def merge(base: dict, override: dict) -> dict:
+    """Merge override into base, section by section."""
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+class Config:
+    """
+    The config.yaml, piecewise overwritten by config_local.yaml if it exists.
+
+    Both files are watched by modification time. A change is loaded and validated as
+    a whole, and only then swapped in, such that readers never see a partially loaded
+    or invalid config. An invalid change is logged and ignored. Components that need to
+    be rebuilt when a key changes register a callback with subscribe.
+    """
+    def __init__(self, default_path: Path, local_path: Path):
+        self.paths = [default_path, local_path]
+        self._mtimes = self._current_mtimes()
+        self._subscribers: List[Tuple[List[str], Callable[[], None]]] = []
+        self._lock = threading.Lock()
+        self._data = self._read()
+        errors = validate(self._data, config_schema)
+        if errors:
+            raise Exception('Invalid config: ' + '; '.join(errors))
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def _current_mtimes(self):
+        return [p.stat().st_mtime if p.exists() else None for p in self.paths]
+
+    def _read(self) -> dict:
+        data = {}
+        for path in self.paths:
+            if path.exists():
+                data = merge(data, yaml.load(path.open(), yaml.FullLoader) or {})
+        return data
+
+    def subscribe(self, keys: List[str], callback: Callable[[], None]):
+        """Call callback after a reload that changed any of the given top level keys."""
+        self._subscribers.append((keys, callback))
+
+    def reload(self) -> bool:
+        """@return: whether the new config was valid and applied"""
+        with self._lock:
+            self._mtimes = self._current_mtimes()
+            try:
+                data = self._read()
+            except yaml.YAMLError as e:
+                logging.error(f'Not reloading the config, it is not valid YAML: {e}')
+                return False
+            errors = validate(data, config_schema)
+            if errors:
+                logging.error('Not reloading the config: ' + '; '.join(errors))
+                return False
+            old, self._data = self._data, data
+        changed = {k for k in old.keys() | data.keys() if old.get(k) != data.get(k)}
+        if changed:
+            logging.info(f'Reloaded config, changed: {", ".join(sorted(changed))}')
+        for keys, callback in self._subscribers:
+            if changed.intersection(keys):
+                try:
+                    callback()
+                except Exception:
+                    logging.exception(f'Failed to apply config change of {keys}')
+        return True
+
+    def watch(self, interval: float = 1):
+        """Reload the config whenever one of the files changes, in a background thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                if self._current_mtimes() != self._mtimes:
+                    self.reload()
+        threading.Thread(target=run, name='config-watcher', daemon=True).start()
 
-# Load the local config to overwrite defaults if it exists
 config_local_path = project_path / 'config_local.yaml'
-if config_local_path.exists(): 
-    config.update(yaml.load(config_local_path.open(), yaml.FullLoader))
+config = Config(project_path / 'config.yaml', config_local_path)
@@ -1,24 +1,44 @@
+import threading
+import weakref
 from enum import Enum
-from typing import List
 
+from cancellation import CancellationToken
 
-class ThreadState(Enum):
-    RUNNING = 0
-    ABORTION_REQUESTED = 1
-    ABORTION_PROCESSED = 2
 
-class ThreadInfo:
-    def __init__(self, thread, thread_state):
-        self.thread = thread
-        self.thread_state = thread_state
+class JobState(Enum):
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
 
-    def __str__(self):
-        return f'{self.thread} ({self.thread_state})'
+class SessionState(Enum):
+    RECORDING = 0
+    TRANSCRIBING = 1
+    DELIVERING = 2
+    DONE = 3
+    ABORTED = 4
+    FAILED = 5
 
 class ServerState:
-    def __init__(self, recording_started: bool, thread_infos: List[ThreadInfo]):
-        self.recording_started = recording_started
-        self.thread_infos = thread_infos
+    def __init__(self, sessions, batch_queue=None):
+        self.sessions = sessions
+        self.batch_queue = batch_queue
+        self._tokens = weakref.WeakSet()
+        self._tokens_lock = threading.Lock()
+
+    def new_cancellation_token(self) -> CancellationToken:
+        """Create the token for a new session, which is cancelled by the next abort."""
+        token = CancellationToken()
+        with self._tokens_lock:
+            self._tokens.add(token)
+        return token
+
+    def abort(self):
+        """Cancel all sessions that exist now. Sessions started afterwards are not affected."""
+        with self._tokens_lock:
+            tokens = list(self._tokens)
+        for token in tokens:
+            token.cancel()
 
     def __str__(self):
-        return f'{self.recording_started} {self.thread_infos}'
+        return f'{self.sessions}'
@@ -0,0 +1,52 @@
+import numpy as np
+
+frame_seconds = 0.02
+# Quieter frames are never speech, e.g. when the floor is digital silence.
+min_speech_db = -50
+
+
+class EndpointDetector:
+    """
+    Detects the end of an utterance in a stream of 16 bit mono PCM chunks.
+
+    Every chunk is split into 20 ms frames, whose energies are computed at once. A frame
+    is speech if it is threshold_db louder than the noise floor, which follows the
+    quiet frames, and louder than min_speech_db. The utterance ended when there were at
+    least min_utterance seconds of speech, followed by trailing_silence seconds without
+    speech.
+    """
+    def __init__(self, rate: int, trailing_silence: float, min_utterance: float, threshold_db: float):
+        self.frame = int(rate * frame_seconds)
+        self.trailing_silence = trailing_silence
+        self.min_utterance = min_utterance
+        self.threshold_db = threshold_db
+        self.rest = np.zeros(0, dtype=np.float32)
+        self.noise_floor = None
+        self.speech = 0.0
+        self.silence = 0.0
+
+    def energies(self, data: bytes) -> np.ndarray:
+        """@return: the energy of every complete frame in dBFS. The rest is kept for the next chunk."""
+        samples = np.concatenate([self.rest, np.frombuffer(data, dtype=np.int16) / 32768])
+        n = len(samples) // self.frame * self.frame
+        self.rest = samples[n:]
+        frames = samples[:n].reshape(-1, self.frame)
+        return 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+    def feed(self, data: bytes) -> bool:
+        """@return: True once the utterance ended"""
+        for db in self.energies(data):
+            if self.noise_floor is None:
+                # The recording can start with speech, so the first frame is not
+                # necessarily noise.
+                self.noise_floor = min(db, min_speech_db)
+            if db > max(self.noise_floor + self.threshold_db, min_speech_db):
+                self.speech += frame_seconds
+                self.silence = 0.0
+                # Rise slowly, such that a floor that started too low does not
+                # make all frames speech.
+                self.noise_floor += 0.01
+            else:
+                self.silence += frame_seconds
+                self.noise_floor = 0.95 * self.noise_floor + 0.05 * db
+        return self.speech >= self.min_utterance and self.silence >= self.trailing_silence
@@ -0,0 +1,123 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from cancellation import Cancelled, CancellationToken
+
+
+class LatencyTracker:
+    """
+    Recent transcription latencies, relative to the duration of the audio.
+
+    Latency grows with the length of the audio, so the threshold for a request is
+    derived from seconds of latency per second of audio. Clips shorter than one second
+    count as one second, as their latency is dominated by the request overhead.
+    """
+    def __init__(self, window: int = 100):
+        self.ratios = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(duration):
+        return max(duration, 1.0)
+
+    def record(self, latency: float, duration: float):
+        with self.lock:
+            self.ratios.append(latency / self._normalize(duration))
+
+    def threshold(self, duration: float, percentile: float, min_samples: int, default_ratio: float) -> float:
+        """@param default_ratio: seconds of latency per second of audio, until min_samples were recorded
+        @return: the latency in seconds after which a request for audio of the given duration is late"""
+        with self.lock:
+            ratios = sorted(self.ratios)
+        if len(ratios) < min_samples:
+            ratio = default_ratio
+        else:
+            ratio = ratios[min(len(ratios) - 1, int(percentile * len(ratios)))]
+        return ratio * self._normalize(duration)
+
+class HedgedTranscriber:
+    """
+    Send a duplicate transcription request if the first one is slower than usual.
+
+    The primary request is started immediately. If it did not finish within the
+    adaptive threshold of the LatencyTracker, a hedged request is sent, to the
+    secondary backend if one is configured. The first successful response is used and
+    the other request is cancelled. If one request fails, the other one is awaited.
+
+    @param transcribe: called as transcribe(audio, token, backend) -> response
+    """
+    def __init__(self, transcribe: Callable, tracker: Optional[LatencyTracker] = None):
+        self.transcribe = transcribe
+        self.tracker = tracker if tracker else LatencyTracker()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def __call__(self, audio, duration: float, token: CancellationToken, primary, secondary=None,
+                 percentile=0.95, min_samples=10, default_ratio=1.0):
+        results: queue.Queue = queue.Queue()
+        attempts = []
+
+        def start(name, backend):
+            attempt_token = CancellationToken()
+            unregister = token.on_cancel(attempt_token.cancel)
+            attempts.append(attempt_token)
+
+            def run():
+                try:
+                    results.put((name, self.transcribe(audio, attempt_token, backend), None))
+                except BaseException as e:
+                    results.put((name, None, e))
+                finally:
+                    unregister()
+            threading.Thread(target=run, name=f'transcription-{name}', daemon=True).start()
+
+        with self.lock:
+            self.requests += 1
+        # The latency is measured from the primary request, also if the hedge wins, as
+        # that is how long the caller waited.
+        start_time = time.time()
+        start('primary', primary)
+        threshold = self.tracker.threshold(duration, percentile, min_samples, default_ratio)
+        try:
+            result = results.get(timeout=threshold)
+        except queue.Empty:
+            logging.info(f'Transcription slower than {threshold:.1f}s, sending hedged request.')
+            with self.lock:
+                self.hedged += 1
+            start('hedge', secondary if secondary else primary)
+            result = results.get()
+
+        pending = len(attempts) - 1
+        first_error = None
+        while True:
+            name, response, error = result
+            if error is None:
+                break
+            if isinstance(error, Cancelled) and token.cancelled:
+                raise error
+            logging.info(f'{name} transcription request failed: {error}')
+            first_error = first_error or error
+            if pending == 0:
+                raise first_error
+            pending -= 1
+            result = results.get()
+
+        for attempt_token in attempts:
+            attempt_token.cancel()
+        self.tracker.record(time.time() - start_time, duration)
+        if name == 'hedge':
+            with self.lock:
+                self.hedge_wins += 1
+        return response
+
+    def status(self) -> str:
+        with self.lock:
+            rate = self.hedged / self.requests if self.requests else 0
+            return (f"Transcription requests: {self.requests}, hedged: {self.hedged} ({rate:.0%}), "
+                    f"won by hedge: {self.hedge_wins}\n")
@@ -0,0 +1,221 @@
+"""Load test for the command socket of the server.
+
+Opens many concurrent client connections with a weighted mix of commands, and reports
+the throughput, the latency percentiles per command, the number of server threads
+and the errors. Run it against a server started with stubbed audio and backends:
+
+    python main.py --use-debug-port --stub-backends
+    python load_test.py --clients 20 --duration 30 --mix status=10,record=1,list-transcriptions=2
+
+A command that reaches the server cut off, e.g. because it is longer than a single
+recv, shows up as a rejected command or as a connection without any response.
+"""
+import argparse
+import random
+import re
+import shlex
+import socket
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import config
+
+common_flags = ['--notifier-system', 'no-popup']
+
+
+class Client:
+    def __init__(self, host: str, port: int, timeout: float, padding: int, split_send: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.split_send = split_send
+        # The server resolves relative paths against the working directory, so padding
+        # it with /. makes the command longer without changing its meaning.
+        self.working_dir = str(Path.cwd()) + '/.' * (padding // 2)
+
+    def send(self, args: List[str]) -> str:
+        """Send one command like the client script does. @return: the full response"""
+        command = ' '.join(shlex.quote(a) for a in ['--working-dir', self.working_dir, *common_flags, *args])
+        data = command.encode()
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as conn:
+            if self.split_send:
+                # Like a client whose command arrives in two TCP segments.
+                conn.sendall(data[:len(data) // 2])
+                time.sleep(self.split_send)
+                data = data[len(data) // 2:]
+            conn.sendall(data)
+            response = bytearray()
+            while part := conn.recv(65536):
+                response += part
+        return response.decode(errors='replace')
+
+def classify(kind: str, response: str) -> Optional[str]:
+    """@return: the kind of error, or None if the response is as expected"""
+    if 'Traceback' in response:
+        return 'server exception'
+    if response.lstrip().startswith('usage:') or 'error:' in response:
+        return 'rejected command (truncated?)'
+    if kind == 'status' and 'Sever is running' not in response:
+        return 'no response' if not response else 'unexpected response'
+    if kind == 'transcribe-file' and not response:
+        return 'no response'
+    return None
+
+class LoadTest:
+    def __init__(self, client: Client, mix: Dict[str, int], record_seconds: float, file: Optional[Path]):
+        self.client = client
+        self.mix = mix
+        self.record_seconds = record_seconds
+        self.file = file
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.thread_counts: List[int] = []
+        self.session_counts: List[int] = []
+        self.stop = threading.Event()
+
+    def run_command(self, kind: str) -> Tuple[str, Optional[str]]:
+        if kind == 'status':
+            return self.client.send(['--status']), None
+        if kind == 'list-transcriptions':
+            return self.client.send(['--list-transcriptions']), None
+        if kind == 'transcribe-file':
+            return self.client.send(['--transcribe-file', str(self.file), '--std-out']), None
+        if kind == 'record':
+            # Stop the recording from a second connection. If another client is already
+            # recording, the start returns at once, and the stop ends the other recording.
+            timer = threading.Timer(self.record_seconds, lambda: self.client.send(['--stop']))
+            timer.start()
+            try:
+                return self.client.send(['--start', '--std-out']), None
+            finally:
+                timer.join()
+        if kind == 'toggle-pause':
+            return self.client.send(['--toggle-pause']), None
+        raise ValueError(f'Unknown command kind {kind}')
+
+    def worker(self, deadline: float, remaining: Optional[List[int]]):
+        kinds, weights = zip(*self.mix.items())
+        while time.monotonic() < deadline and not self.stop.is_set():
+            if remaining is not None:
+                with self.lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            kind = random.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            try:
+                response, error = self.run_command(kind)
+                error = error or classify(kind, response)
+            except socket.timeout:
+                error = 'timeout'
+            except ConnectionResetError:
+                # The server closed the connection with part of the command still unread.
+                error = 'connection reset (truncated?)'
+            except OSError as e:
+                error = f'connection error ({e.__class__.__name__})'
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.latencies[kind].append(latency)
+                if error:
+                    self.errors[(kind, error)] += 1
+
+    def monitor(self, interval: float):
+        """Poll the status of the server for the number of threads and sessions."""
+        while not self.stop.wait(interval):
+            try:
+                status = self.client.send(['--status'])
+            except OSError:
+                continue
+            threads = re.search(r'Active Threads: (\d+)', status)
+            sessions = re.search(r'Sessions in flight: (\d+)', status)
+            with self.lock:
+                if threads:
+                    self.thread_counts.append(int(threads.group(1)))
+                if sessions:
+                    self.session_counts.append(int(sessions.group(1)))
+
+    def run(self, clients: int, duration: float, requests: Optional[int], monitor_interval: float) -> float:
+        """@return: the wall time of the test in seconds"""
+        deadline = time.monotonic() + duration
+        remaining = [requests] if requests else None
+        monitor = threading.Thread(target=self.monitor, args=[monitor_interval], daemon=True)
+        monitor.start()
+        workers = [threading.Thread(target=self.worker, args=[deadline, remaining], daemon=True)
+                   for _ in range(clients)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        try:
+            for w in workers:
+                w.join()
+        except KeyboardInterrupt:
+            self.stop.set()
+            for w in workers:
+                w.join()
+        wall_time = time.perf_counter() - start
+        self.stop.set()
+        monitor.join()
+        return wall_time
+
+    def report(self, wall_time: float):
+        total = sum(len(l) for l in self.latencies.values())
+        print(f'{total} commands in {wall_time:.1f}s, {total / wall_time:.1f} commands/s, '
+              f'{sum(self.errors.values())} errors')
+        print(f'{"":22} {"count":>7} {"errors":>7} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+        for kind, latencies in sorted(self.latencies.items()):
+            errors = sum(n for (k, _), n in self.errors.items() if k == kind)
+            ms = [l * 1000 for l in latencies]
+            print(f'{kind:22} {len(ms):7d} {errors:7d} {percentile(ms, 0.5):9.1f} '
+                  f'{percentile(ms, 0.9):9.1f} {percentile(ms, 0.99):9.1f} {max(ms):9.1f}')
+        for name, counts in [('server threads', self.thread_counts), ('sessions in flight', self.session_counts)]:
+            if counts:
+                print(f'{name}: min {min(counts)}, mean {statistics.fmean(counts):.1f}, max {max(counts)}')
+        if self.errors:
+            print('errors:')
+            for (kind, error), n in self.errors.most_common():
+                print(f'  {kind}: {error}: {n}')
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        weights[kind.strip()] = int(weight or 1)
+    return weights
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the command socket of a running server.')
+    parser.add_argument('--host', default=config['IP'])
+    parser.add_argument('--port', type=int, default=config['debug_port'],
+        help='Defaults to the debug port, as used by main.py --use-debug-port.')
+    parser.add_argument('--clients', type=int, default=10, help='Number of concurrent clients.')
+    parser.add_argument('--duration', type=float, default=10, help='Run for at most this many seconds.')
+    parser.add_argument('--requests', type=int, help='Stop after this many commands.')
+    parser.add_argument('--mix', default='status=10,list-transcriptions=2,record=1',
+        help='Comma separated command kinds with weights. Kinds: status, list-transcriptions, '
+        'record, toggle-pause, transcribe-file.')
+    parser.add_argument('--file', type=Path, help='The audio file for the transcribe-file commands.')
+    parser.add_argument('--record-seconds', type=float, default=1, help='Length of a recording.')
+    parser.add_argument('--pad', type=int, default=0,
+        help='Make every command about this many bytes longer, e.g. to exceed the receive buffer of the server.')
+    parser.add_argument('--split-send', type=float, default=0,
+        help='Send every command in two parts, this many seconds apart.')
+    parser.add_argument('--timeout', type=float, default=60, help='Socket timeout in seconds.')
+    parser.add_argument('--monitor-interval', type=float, default=0.5,
+        help='How often the thread count of the server is polled, in seconds.')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if 'transcribe-file' in mix and not args.file:
+        parser.error('The transcribe-file command needs --file.')
+    client = Client(args.host, args.port, args.timeout, args.pad, args.split_send)
+    test = LoadTest(client, mix, args.record_seconds, args.file.absolute() if args.file else None)
+    test.report(test.run(args.clients, args.duration, args.requests, args.monitor_interval))
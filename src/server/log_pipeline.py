@@ -0,0 +1,100 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+
+from rich.logging import RichHandler
+
+# Third party loggers that are too chatty for the debug log.
+quiet_loggers = ['urllib3', 'websockets', 'asyncio', 'PIL']
+
+_context = threading.local()
+_file_handler = None
+
+
+class _SessionFilter(logging.Filter):
+    """Tag every record with the session of the thread that logged it."""
+    def filter(self, record):
+        record.session = getattr(_context, 'session', '-')
+        return True
+
+class _KeepExcInfoQueueHandler(QueueHandler):
+    """Only resolves the message on the logging thread. Unlike QueueHandler.prepare the
+    exception info is kept, such that the console still shows rich tracebacks."""
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'thread': record.threadName,
+                 'session': record.session, 'message': record.getMessage()}
+        for key in ['stage', 'duration']:
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+def setup_logging(debug: bool, log_path: Path, max_megabytes: float, backups: int, json_lines: bool):
+    """
+    Send all logging through a queue, such that formatting and I/O happen on a listener
+    thread instead of the thread that logs.
+
+    The console shows INFO, or DEBUG if debug is set. The log file always gets DEBUG, with
+    the time, thread and session of every record, and is rotated at max_megabytes.
+    @param json_lines: write the log file as one JSON object per line
+    """
+    console = RichHandler(rich_tracebacks=True, log_time_format='[%X]')
+    console.setLevel(logging.DEBUG if debug else logging.INFO)
+    global _file_handler
+    file = RotatingFileHandler(log_path)
+    file.setLevel(logging.DEBUG)
+    _file_handler = file
+    configure_log_file(max_megabytes, backups, json_lines)
+
+    log_queue: queue.Queue = queue.Queue()
+    listener = QueueListener(log_queue, console, file, respect_handler_level=True)
+    handler = _KeepExcInfoQueueHandler(log_queue)
+    handler.addFilter(_SessionFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.DEBUG)
+    for name in quiet_loggers:
+        logging.getLogger(name).setLevel(logging.INFO)
+    listener.start()
+    atexit.register(listener.stop)
+
+def configure_log_file(max_megabytes: float, backups: int, json_lines: bool):
+    """Change the rotation and format of the log file set up by setup_logging, e.g. after the config changed."""
+    file: RotatingFileHandler = _file_handler # type: ignore
+    file.maxBytes = int(max_megabytes * 1024 * 1024)
+    file.backupCount = backups
+    file.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter(
+        '%(asctime)s %(levelname)-7s %(threadName)s [%(session)s] %(message)s'))
+
+@contextmanager
+def session_context(session_id: str):
+    """Tag the records logged by this thread with the session id."""
+    previous = getattr(_context, 'session', '-')
+    _context.session = session_id
+    try:
+        yield
+    finally:
+        _context.session = previous
+
+@contextmanager
+def stage(name: str):
+    """Log how long the stage took, also if it failed."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        logging.debug(f'Stage {name} took {duration:.3f}s', extra={'stage': name, 'duration': round(duration, 3)})
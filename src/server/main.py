@@ -1,17 +1,17 @@
 import argparse
 import atexit
+import hmac
 import io
+import ipaddress
 import logging
 import os
+import re
 import shlex
 import socket
-import subprocess
 import sys
-import tempfile
 import threading
 import time
 import traceback
-import wave
 import shutil
 from collections import namedtuple
 from contextlib import redirect_stderr, redirect_stdout
@@ -19,24 +19,42 @@ from datetime import datetime, timedelta
 from pathlib import Path
 
 import xdg_base_dirs
-import ffmpeg
+import numpy as np
 import openai
-import pyaudio
 import soundfile as sf
 import yaml
-from config import (abort_signal_file, audio_path, config, error_icon,
-                    instance_lock_path, lock_path, pause_icon,
-                    pause_signal_file, processing_icon, program_start_time,
-                    project_path, record_icon, running_signal_file,
-                    stop_signal_file, transcription_file)
-from data_structures import ServerState, ThreadInfo, ThreadState
+from announcements import Announcer
+from assembly_ai import AssemblyAIStreamer
+from assembly_ai import load_api_key as load_assembly_ai_api_key
+from audio_capture import AudioCapture
+from audio_decoding import estimate_segment_count, iter_segments, prefetch
+from batch_queue import BatchQueue, expand_paths, is_batch_pattern
+from cancellation import Cancelled, CancellationToken
+from checkpoint import SegmentCheckpoint
+from coalescing import Coalescer
+from config import (announcement_cache_dir, audio_path, batch_queue_file, config, debug_log_path, error_icon,
+                    instance_lock_path, lock_path, logs_dir, pause_icon,
+                    processing_icon, program_start_time,
+                    project_path, record_icon, transcription_file)
+from data_structures import ServerState, SessionState
 from desktop_notifier import DesktopNotifier, Urgency
+from endpointing import EndpointDetector
+from hedging import HedgedTranscriber
+from log_pipeline import configure_log_file, session_context, setup_logging, stage
+from openai_api import transcribe_audio
 from paste import paste_text
+from profiler import SamplingProfiler
+from stubs import SilentCapture, stub_transcribe_audio
 from popup import (Dzen2Popup, MacOSAlertPopup, TerminalNotifierPopup,
                    TkinterPopup, NoPopup)
 from rich import print
-from rich.logging import RichHandler
+from retention import RetentionWorker, list_recordings
+from remote_capture import serve_recording
+from remote_capture import sample_rate as remote_sample_rate
+from sessions import RecordingSession, SessionManager, inserts
+import text_processing
 from text_processing import process_transcription
+from vocabulary import Vocabulary
 
 network_command_parser = argparse.ArgumentParser(exit_on_error=False, add_help=False, prog="",
     description=f'The default config can be picewise overwritten by a config_local.yaml '
@@ -50,7 +68,8 @@ network_command_parser.add_argument('--toggle-recording', action='store_true',
 network_command_parser.add_argument('--toggle-pause', action='store_true', 
     help='Pause/Unpause the recording.')
 network_command_parser.add_argument('--abort', action='store_true', 
-    help="Stop the recording and don't transcribe it")
+    help="Stop the recording and don't transcribe it. Also cancels all other commands that are "
+    "still running, e.g. transcriptions, but not the batch queue.")
 network_command_parser.add_argument('--clear-notifications', action='store_true', 
     help='Clear all notifications')
 network_command_parser.add_argument('--no-postprocessing', action='store_true', 
@@ -70,11 +89,22 @@ network_command_parser.add_argument('--transcribe-file', type=Path,
     "files in the audio directory. `-t ./podcast.mp3` will look for a file 'podcast.mp3' in the current "
     "working directory, and transcribe that. `-t /home/user/recordings/2023_06_11-12_53_28.mp3` will look "
     "for a file '2023_06_11-12_53_28.mp3' in the directory '/home/user/memo.mp3' or '~/memo.mp3' will look "
-    "for a file 'memo.mp3' in the home directory, and transcribe that.")
+    "for a file 'memo.mp3' in the home directory, and transcribe that. If the argument is a directory or "
+    "a glob pattern like './recordings/*.m4a', all matching audio files are added to the persistent batch "
+    "queue instead, and transcribed in the background. Their progress is shown by --status.")
 network_command_parser.add_argument('--list-recordings', action='store_true', 
     help="List the paths of recorded audio.")
 network_command_parser.add_argument('--only-record', action='store_true', 
     help="Only record, don't transcribe.")
+network_command_parser.add_argument('--streaming', action='store_true', 
+    help="Transcribe in real time with AssemblyAI while recording, inserting every finished phrase "
+    "while you are still speaking.")
+network_command_parser.add_argument('--remote-capture', action='store_true', 
+    help="Receive the audio from a remote client over this connection, transcribe it and send back "
+    "the text. This is used by remote_capture.py, which records on another machine and pastes there.")
+network_command_parser.add_argument('--auto-stop', action='store_true', 
+    help="Stop the recording by itself when you stopped speaking, see auto_stop in the config. "
+    "Stopping it manually still works.")
 network_command_parser.add_argument('--clipboard', action='store_true', 
     help="Don't paste, only copy to clipboard.")
 network_command_parser.add_argument('--std-out', action='store_true', 
@@ -90,10 +120,18 @@ network_command_parser.add_argument('--shutdown', action='store_true',
     "and the service is configured to restart automatically.")
 network_command_parser.add_argument('--status', action='store_true', 
     help="Show the status of the server.")
+network_command_parser.add_argument('--profile', type=float, metavar='N',
+    help="Profile all server threads for the next N seconds, and return the collapsed stacks, which "
+    "can be turned into a flame graph e.g. with flamegraph.pl or speedscope. The report is also written "
+    "to the logs directory.")
+network_command_parser.add_argument('--profile-sessions', action='store_true', 
+    help="With --profile, profile until N recording sessions finished instead of for N seconds.")
 network_command_parser.add_argument('--test-error', action='store_true', 
     help="Raise an error in the network argument branching section for testing purposes.")
 network_command_parser.add_argument('--working-dir', type=Path, required=True,
     help='The working directory to use for file operations. This would normally be set automatically be the client.')
+network_command_parser.add_argument('--secret', type=str,
+    help='The remote_secret of the server config. Required for commands from other machines.')
 network_command_parser.add_argument('--notifier-system', type=str, required=False,
     help='The notification system to use. Setting this overwrites the config file value.')
 
@@ -106,39 +144,37 @@ cli_parser.add_argument('--use-debug-port', action='store_true',
                         'in a way that also allows to run the service in the background. '
                         'This works by using a different port. Use debug-client to connect '
                         'to this instance.')
+cli_parser.add_argument('--stub-backends', action='store_true',
+                        help='Record silence instead of the microphone, and answer transcription requests '
+                        'with a stub after a short delay, instead of calling the API. For load testing '
+                        'with load_test.py.')
 cli_parser.add_argument('--help-client', action='store_true', 
                         help='Show the help message for the client.')
 cli_args = cli_parser.parse_args()
 
-logging.basicConfig(
-    level=logging.DEBUG if cli_args.debug_log else logging.INFO, 
-    format="%(message)s", datefmt="[%X]", handlers=[RichHandler(rich_tracebacks=True)])
+setup_logging(cli_args.debug_log, debug_log_path, config['debug_log']['max_megabytes'],
+              config['debug_log']['backups'], config['debug_log']['json_lines'])
 
 if cli_args.help_client:
     network_command_parser.print_help()
     exit()
 
-# Setup the pyaudio recording stream
-p = pyaudio.PyAudio()
-chunk = 1024*4  # Record in chunks of 1024 samples
-sample_format = pyaudio.paInt16  # 16 bits per sample
-channels = 1
-fs = 44100  # Record at 44100 samples per second
-stream = p.open(format=sample_format,
-                channels=channels,
-                rate=fs,
-                frames_per_buffer=chunk, 
-                input=True,
-                start=False)
+# The microphone stream, shared by all recording sessions
+if cli_args.stub_backends:
+    audio_capture = SilentCapture()
+else:
+    audio_capture = AudioCapture(input_device_index=config['input_device_index'])
+fs = audio_capture.rate
+server_sessions = SessionManager()
+retention_worker = RetentionWorker(audio_path, lambda: config['audio_retention'])
 
 
 config_home = xdg_base_dirs.xdg_config_home() / 'system-wide-whisper'
 
 @atexit.register
 def pyaudio_cleanup():
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
+    audio_capture.close()
+    announcer.close()
 
 def setup_api_key():
     if 'OPENAI_API_KEY' in os.environ:
@@ -153,11 +189,41 @@ def setup_api_key():
     openai.api_key = openai_api_key
 
 # Somehow this does not work if not called here (if called in the main function this breaks)
-setup_api_key()
-
-def openai_transcibe(mp3_path):
-    out = openai.Audio.transcribe(config['model'], open(mp3_path, "rb"), language=config['input_language'])
-    return out.text # type: ignore
+if cli_args.stub_backends:
+    transcription_backend = stub_transcribe_audio
+else:
+    setup_api_key()
+    transcription_backend = transcribe_audio
+
+hedged_transcribe = HedgedTranscriber(lambda audio, token, backend: transcription_backend(audio, token, **backend))
+
+def audio_duration(audio) -> float:
+    """@param audio: a path, or an open file object"""
+    duration = sf.info(audio).duration
+    if not isinstance(audio, (str, Path)):
+        audio.seek(0)
+    return duration
+
+def openai_transcibe(audio, token):
+    """If hedging is enabled in the config, a duplicate request is sent when the response
+    takes longer than usual for audio of this length, see HedgedTranscriber.
+    @param audio: a path, or an open file object with a name attribute that has the right extension
+    @raise Cancelled: as soon as the token is cancelled, also during the upload"""
+    primary = primary_backend()
+    hedging = config['hedging']
+    if not hedging['enabled']:
+        return transcription_backend(audio, token, **primary)['text']
+    secondary = {**primary, **hedging['secondary_backend']} if hedging['secondary_backend'] else None
+    out = hedged_transcribe(audio, audio_duration(audio), token, primary, secondary,
+                            hedging['percentile'], hedging['min_samples'], hedging['default_ratio'])
+    return out['text']
+
+def primary_backend():
+    return {'model': config['model'], 'api_key': openai.api_key, 'language': config['input_language']}
+
+coalescer = Coalescer(lambda audio, token, response_format:
+                          transcription_backend(audio, token, response_format=response_format, **primary_backend()),
+                      lambda: config['coalescing'])
 
 def push_notification(title, message, icon, network_args):
     """Push a persistent notification to the user, which stays until it is programmatically cleared.
@@ -187,54 +253,25 @@ def clear_notification(notification):
     logging.debug(f"Clearing notification: {notification}")
     notification.clear()
 
-def record(network_args) -> str:
-    """Record audio and save it to an mp3 file.
-    @return: path to the mp3 file"""
-    stop_signal_file.unlink(missing_ok=True)
-    pause_signal_file.unlink(missing_ok=True)
-    abort_signal_file.unlink(missing_ok=True)
-
-    global stream
-    global fs
-    global p
-    # The OS is sometimes closing the stream, maybe when it is active to long, so we need
-    # to reopen it if it is not active.
-    try:
-        active = stream.is_active()
-        if not active:
-            stream.stop_stream()
-            stream.close()
-            stream = p.open(format=sample_format,
-                            channels=channels,
-                            rate=fs,
-                            frames_per_buffer=chunk, 
-                            input=True,
-                            start=False)
-    except OSError:
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
-        p = pyaudio.PyAudio()
-        stream = p.open(format=sample_format,
-                        channels=channels,
-                        rate=fs,
-                        frames_per_buffer=chunk, 
-                        input=True,
-                        start=False)
-
-    logging.debug('Recording')
+def record(session: RecordingSession, on_chunk=None) -> str:
+    """Record audio into the session's buffer until the session is stopped, and save it to an mp3 file.
+    @param on_chunk: called with every captured chunk of raw audio, e.g. to stream it.
+    @return: path to the mp3 file
+    @raise Cancelled: if the token was cancelled during the recording. The audio is still saved,
+        unless nothing was recorded."""
+    network_args = session.network_args
+    logging.debug(f'Recording session {session.id}')
     n1 = push_notification("Recording for Whisper", "Recording for Whisper", record_icon, network_args)
-
-    # Record audio
-    frames = []  # Initialize array to store frames
     n_pause = None
-    global speak_proc
-    stream.start_stream()
-    while not (abort_signal_file.exists() or stop_signal_file.exists()):
-        data = stream.read(chunk)
-        if speak_proc is None or speak_proc.poll() is not None:
-            if not pause_signal_file.exists():
-                frames.append(data)
+    session.on_chunk = on_chunk
+    if network_args.auto_stop:
+        auto_stop = config['auto_stop']
+        session.endpointer = EndpointDetector(fs, auto_stop['trailing_silence'], auto_stop['min_utterance'],
+                                              auto_stop['threshold_db'])
+    audio_capture.subscribe(session.add_chunk)
+    try:
+        while not session.stopped.wait(0.05):
+            if not session.paused.is_set():
                 if n1 is None:
                     n1 = push_notification("Recording for Whisper", "Recording for Whisper", record_icon, network_args)
                 if n_pause:
@@ -245,57 +282,55 @@ def record(network_args) -> str:
                     clear_notification(n1)
                     n1 = None
                     n_pause = push_notification("Paused Recording", "Paused Recording", pause_icon, network_args)
-    stream.stop_stream()
-
-    if n_pause:
-        clear_notification(n_pause)
-    if n1:
-        clear_notification(n1)
-
-    stop_signal_file.unlink(missing_ok=True)
+    finally:
+        audio_capture.unsubscribe(session.add_chunk)
+        server_sessions.recording_finished(session)
+        if n_pause:
+            clear_notification(n_pause)
+        if n1:
+            clear_notification(n1)
 
     logging.debug('Completed Audio Capture')
-
-    # Save the recorded data as a WAV file
-    mp3_path = f"{audio_path}/{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}.mp3"
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        wav_path = f"{tmp_dir}/temp.wav"
-        logging.debug('saving wav')
-        wf = wave.open(wav_path, 'wb')
-        wf.setnchannels(channels)
-        wf.setsampwidth(p.get_sample_size(sample_format))
-        wf.setframerate(fs)
-        wf.writeframes(b''.join(frames))
-        wf.close()
-
-        # Convert WAV to mp3
-        logging.debug('saving mp3')
-        data, fs = sf.read(wav_path) 
-        sf.write(mp3_path, data, fs)
-
-    logging.info(f"Finished Recording {Path(mp3_path).name}")
-
-    if abort_signal_file.exists():
-        abort_signal_file.unlink(missing_ok=True)
-        running_signal_file.unlink(missing_ok=True)
-        exit(0)
-
-    return mp3_path
-
-def transcribe(network_args, mp3_path):
+    if not session.frames:
+        # E.g. aborted right after the start. An empty file can't be decoded, don't keep it.
+        session.token.raise_if_cancelled()
+        raise Exception('Nothing was recorded.')
+
+    timestamp = datetime.now().strftime('%Y_%m_%d-%H_%M_%S')
+    mp3_path = audio_path / f"{timestamp}.mp3"
+    if mp3_path.exists():
+        # Back to back sessions can finish within the same second.
+        mp3_path = audio_path / f"{timestamp}-{session.id}.mp3"
+    logging.debug('saving mp3')
+    sf.write(mp3_path, np.frombuffer(b''.join(session.frames), dtype=np.int16), fs)
+
+    logging.info(f"Finished Recording {mp3_path.name}")
+    retention_worker.notify()
+
+    session.token.raise_if_cancelled()
+    return str(mp3_path)
+
+def transcribe(network_args, mp3_path, token, backend=openai_transcibe):
+    """@param mp3_path: a path, or an in-memory audio file with a name attribute
+    @param backend: called as backend(audio, token) -> text"""
     n2 = push_notification("Processing", "Processing", processing_icon, network_args)
-    out = openai_transcibe(mp3_path)
-    out = process_transcription(network_args, out)
+    try:
+        with stage('transcribe'):
+            out = backend(mp3_path, token)
+    finally:
+        clear_notification(n2)
+    with stage('postprocess'):
+        out = process_transcription(network_args, out)
     logging.info(f"transcription:")
     print(out)
+    write_transcription(getattr(mp3_path, 'name', mp3_path), out)
+    return out
 
+def write_transcription(mp3_path, text):
     with transcription_file.open('a') as f:
         f.write('\n')
         f.write(f'>>> {mp3_path} >>>\n')
-        f.write(out)
-
-    clear_notification(n2)
-    return out
+        f.write(text)
 
 def aquire_lock():
     locks = list(lock_path.iterdir())
@@ -308,34 +343,121 @@ def aquire_lock():
                 locks.remove(l)
         time.sleep(0.1)
 
-def asr_pipeline(network_args, server_state):
-    mp3_path = record(network_args)
-    text = transcribe(network_args, mp3_path)
-    if network_args.std_out:
-        return(text)
+def remote_capture(network_args, conn, token) -> str:
+    """Receive a recording streamed by a remote client and transcribe it. The text is
+    returned to the client, which pastes it on its own machine.
+    @return: the transcription"""
+    def transcribe_recording(samples):
+        timestamp = datetime.now().strftime('%Y_%m_%d-%H_%M_%S')
+        mp3_path = audio_path / f"{timestamp}-remote-{threading.get_ident()}.mp3"
+        sf.write(mp3_path, samples, remote_sample_rate)
+        logging.info(f"Received remote recording {mp3_path.name}")
+        retention_worker.notify()
+        return transcribe(network_args, mp3_path, token)
+    return serve_recording(conn, token, transcribe_recording)
+
+profiler = SamplingProfiler()
+# A profile of sessions ends after this many seconds, also if fewer sessions finished.
+max_session_profile_seconds = 3600
+
+def profile(network_args, token) -> Path:
+    """Profile the server for network_args.profile seconds or sessions, or until the token is cancelled.
+    @return: the path of the written report"""
+    n = network_args.profile
+    if network_args.profile_sessions:
+        target = server_sessions.finished_count + n
+        end = time.time() + max_session_profile_seconds
+        done = lambda: server_sessions.finished_count >= target or time.time() >= end or token.cancelled
     else:
-        aquire_lock()
-        paste_text(network_args, text, server_state)
+        end = time.time() + n
+        done = lambda: time.time() >= end or token.cancelled
+    report = profiler.profile(done)
+    report_path = logs_dir / f"profile-{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}.folded"
+    report_path.write_text(report)
+    return report_path
+
+def deliver(session: RecordingSession, text, server_state):
+    """Paste the text of a session, after the texts of all earlier sessions were pasted."""
+    session.state = SessionState.DELIVERING
+    server_sessions.wait_for_turn(session)
+    session.token.raise_if_cancelled()
+    aquire_lock()
+    try:
+        paste_text(session.network_args, text, server_state)
+    finally:
         instance_lock_path.unlink(missing_ok=True)
 
-def trim_audio_files():
-    audio_paths = sorted(audio_path.glob('*.mp3'))
-    records_to_keep = config['number_of_recordings_to_keep']
-    if len(audio_paths) > records_to_keep:
-        for p in audio_paths[:-records_to_keep]:
-            p.unlink()
+def streaming_asr_pipeline(session: RecordingSession, server_state):
+    """Stream the recording to AssemblyAI and insert every finalised phrase as soon as it arrives."""
+    network_args = session.network_args
+    def insert_phrase(text):
+        text = process_transcription(network_args, text)
+        logging.info(f"streamed phrase: {text}")
+        if not network_args.std_out:
+            server_sessions.wait_for_turn(session)
+            paste_text(network_args, text, server_state)
+
+    streamer = AssemblyAIStreamer(load_assembly_ai_api_key(), fs, insert_phrase,
+                                  url=config['assembly_ai_url']).start()
+    session.token.on_cancel(streamer.cancel)
+    try:
+        mp3_path = record(session, on_chunk=streamer.feed)
+    except BaseException:
+        streamer.cancel()
+        raise
+    session.state = SessionState.TRANSCRIBING
+    text = process_transcription(network_args, streamer.finish())
+    write_transcription(mp3_path, text)
+    if network_args.std_out:
+        return text
+
+def session_backend(session: RecordingSession, mp3_path):
+    """Short clips whose text is not inserted right away are coalesced into fewer requests."""
+    args = session.network_args
+    if (args.only_record or args.no_insertion) and coalescer.accepts(audio_duration(mp3_path)):
+        return coalescer
+    return openai_transcibe
+
+def asr_pipeline(session: RecordingSession, server_state):
+    """Record, transcribe and deliver one session. Transcription of a session runs in
+    parallel to the recording of the next one, only the delivery is serialized."""
+    try:
+        with session_context(session.id):
+            if session.network_args.streaming:
+                text = streaming_asr_pipeline(session, server_state)
+            else:
+                with stage('record'):
+                    mp3_path = record(session)
+                session.state = SessionState.TRANSCRIBING
+                text = transcribe(session.network_args, mp3_path, session.token, session_backend(session, mp3_path))
+                if inserts(session.network_args):
+                    with stage('deliver'):
+                        deliver(session, text, server_state)
+                if not session.network_args.std_out:
+                    text = None
+    except Cancelled:
+        server_sessions.finish(session, SessionState.ABORTED)
+        raise
+    except Exception:
+        server_sessions.finish(session, SessionState.FAILED)
+        raise
+    server_sessions.finish(session, SessionState.DONE)
+    return text
+
+announcer = Announcer(announcement_cache_dir, lambda: config['announcement_tts_command'], fs)
+announcements = ['Stop', 'Pause', 'Unpause', 'abort']
+# Don't record the announcements.
+audio_capture.excluded_windows = announcer.playback_windows
 
-speak_proc = None
 def speak(args, text):
     if args.voice_announcements:
-        global speak_proc
-        speak_proc = subprocess.Popen(['gsay', text])
+        announcer.speak(text)
 
-def transcribe_wrapper(network_args, server_state, mp3_path, delete_file=False):
-    text = transcribe(network_args, mp3_path)
+def transcribe_wrapper(network_args, server_state, mp3_path, token, delete_file=False):
+    text = transcribe(network_args, mp3_path, token)
     if delete_file:
         mp3_path.unlink()
-    if network_network_args.std_out:
+    if network_args.std_out:
         return(text)
     else:
         paste_text(network_args, text, server_state)
@@ -354,59 +476,75 @@ def resolve_file(network_args, file_path):
     else:
         return audio_path / network_args.transcribe_file
     
-def generate_mp3(input_file: Path, output_file: Path) -> Path:
-    input_file, output_file = str(input_file), str(output_file) # type: ignore
-    logging.info(f"{input_file} -> {output_file}")
-    stream = ffmpeg.input(input_file)
-    stream = ffmpeg.output(stream, output_file)
-    stream = ffmpeg.overwrite_output(stream)
-    ffmpeg.run(stream)
-    return Path(output_file)
-
-def generate_mp3s(input_file: Path, output_dir: Path) -> Path:
-    input_file, output_dir = str(input_file), str(output_dir) # type: ignore
-    logging.info(input_file, output_dir)
-    proc = subprocess.Popen(['ffmpeg', '-i', input_file, '-f', 'segment', '-segment_time', str(60*20), f'{output_dir}/out%03d.mp3'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    while proc.poll() is None:
-        if abort_signal_file.exists():
-            abort_signal_file.unlink()
-            proc.terminate()
-            raise Exception('Aborted')
-        time.sleep(1)
-    return Path(output_dir)
-
-def argument_branching(network_args, server_state: ServerState, conn):
-    """Handle the network arguments and execute the appropriate functionality."""
+def transcribe_file(network_args, file_path, token, progress=None) -> str:
+    """Transcribe a file of any length by splitting it into segments.
+    The file is decoded in-process and the first segment is uploaded while the rest is
+    still being decoded. Finished segments are checkpointed next to the file, such that
+    after an abort or crash, transcribing the same file again only transcribes the
+    missing segments.
+    @param progress: called as progress(done, total) after every transcribed segment
+    @return: the full transcript
+    @raise Cancelled: if the token is cancelled. The checkpoint is kept."""
+    checkpoint = SegmentCheckpoint(file_path)
+    total = estimate_segment_count(file_path)
+    segments = prefetch(iter_segments(file_path, skip=checkpoint.texts, token=token))
+    try:
+        for index, segment in segments:
+            token.raise_if_cancelled()
+            if segment is not None:
+                checkpoint.add(index, transcribe(network_args, segment, token))
+            if progress:
+                progress(index + 1, max(total, index + 1))
+    except Cancelled:
+        logging.info(f'Aborted, keeping checkpoint {checkpoint.file}')
+        raise
+    text = checkpoint.transcript()
+    checkpoint.discard()
+    return text
+
+def batch_transcribe_file(file_path, options, progress, token):
+    """Transcribe a file from the batch queue, writing the transcript next to it."""
+    flags = ['--working-dir', str(file_path.parent), '--no-insertion']
+    flags += [f"--{k.replace('_', '-')}" for k, v in options.items() if v]
+    text = transcribe_file(network_command_parser.parse_args(flags), file_path, token, progress)
+    # Keep the extension, such that a.mp3 and a.wav don't write the same transcript.
+    file_path.with_name(file_path.name + '.txt').write_text(text)
+    return text
+
+def argument_branching(network_args, server_state: ServerState, conn, token):
+    """Handle the network arguments and execute the appropriate functionality.
+    @param token: the cancellation token of this session"""
+    if network_args.voice_announcements:
+        # Only synthesize the announcements once they are used.
+        announcer.prepare(announcements)
     if network_args.abort:
         logging.debug('Received abort command.')
         speak(network_args, 'abort')
-        abort_signal_file.touch()
-        server_state.recording_started = False
-        for s in server_state.thread_infos:
-            s.thread_state = ThreadState.ABORTION_REQUESTED
-        logging.debug("Set all thread states to ABORTION_REQUESTED.")
-    elif network_args.toggle_recording:
-        logging.info('Received toggle recording command.')
-        if server_state.recording_started:
-            logging.debug("toggle: Stopping recording.")
-            stop_signal_file.touch()
-            running_signal_file.unlink(missing_ok=True)
+        server_state.abort()
+    elif network_args.toggle_recording or network_args.start or network_args.stop:
+        logging.info('Received recording command.')
+        session, started = server_sessions.toggle(network_args, token)
+        if session and not started:
+            logging.debug(f"Stopping recording of session {session.id}.")
             speak(network_args, 'Stop')
-            server_state.recording_started = False
-        else:
-            logging.debug("toggle: Starting recording.")
-            running_signal_file.touch()
-            server_state.recording_started = True
-            text = asr_pipeline(network_args, server_state)
+        elif session:
+            logging.debug(f"Starting recording of session {session.id}.")
+            text = asr_pipeline(session, server_state)
             if text:
                 conn.sendall(text.encode())
+    elif network_args.remote_capture:
+        logging.info('Received remote capture command.')
+        remote_capture(network_args, conn, token)
     elif network_args.toggle_pause:
         logging.info('Received pause recording command.')
-        if pause_signal_file.exists():
-            pause_signal_file.unlink()
+        session = server_sessions.recording
+        if session is None:
+            logging.info('No recording to pause.')
+        elif session.paused.is_set():
+            session.paused.clear()
             speak(network_args, 'Unpause')
         else:
-            pause_signal_file.touch()
+            session.paused.set()
             speak(network_args, 'Pause')
     elif network_args.shutdown:
         logging.info('Received shutdown command.')
@@ -415,19 +553,18 @@ def argument_branching(network_args, server_state: ServerState, conn):
         logging.info('Received list transcriptions command.')
         with transcription_file.open() as f:
             lines = f.readlines()
-        for line in lines:
-            logging.info(f"{line}\n" )
+        logging.info(f'Sending {len(lines)} lines of transcriptions.')
         conn.sendall(''.join(lines).encode())
     elif network_args.transcribe_last:
         logging.info('Received transcribe last command.')
-        transcription_target = sorted(audio_path.glob('*.mp3'))[-1]
-        text = transcribe_wrapper(network_args, server_state, transcription_target)
+        transcription_target = list_recordings(audio_path)[-1]
+        text = transcribe_wrapper(network_args, server_state, transcription_target, token)
         if text:
             conn.sendall(text.encode())
     elif network_args.list_recordings:
         logging.info('Received list recordings command.')
         msg = ''
-        for p in sorted(audio_path.glob('*.mp3')):
+        for p in list_recordings(audio_path):
             duration = timedelta(seconds=int(sf.info(p).duration))
             msg += f"{p}; {duration}\n"
         logging.info(msg)
@@ -437,23 +574,38 @@ def argument_branching(network_args, server_state: ServerState, conn):
         msg = (f"Sever is running\n"
             f"Uptime: {time.time() - program_start_time}s\n"
             f"Active Threads: {threading.active_count()}\n")
+        msg += server_sessions.status()
+        msg += hedged_transcribe.status()
+        msg += coalescer.status()
+        msg += server_state.batch_queue.status()
+        logging.info(msg)
+        conn.sendall(msg.encode())
+    elif network_args.transcribe_file and is_batch_pattern(network_args.transcribe_file, network_args.working_dir):
+        logging.info('Received batch transcribe file command.')
+        paths = expand_paths(network_args.transcribe_file, network_args.working_dir)
+        options = {'no_postprocessing': network_args.no_postprocessing,
+                   'start_lowercase': network_args.start_lowercase}
+        msg = server_state.batch_queue.enqueue(paths, options)
         logging.info(msg)
         conn.sendall(msg.encode())
     elif network_args.transcribe_file:
         logging.info('Received transcribe file command.')
         transcription_target = resolve_file(network_args, network_args.transcribe_file)
         logging.info(f"transcription_target: {transcription_target=}")
-        text = ""
-        with tempfile.TemporaryDirectory() as dir:
-            dir = Path(dir)
-            generate_mp3s(transcription_target, dir)
-            for f in sorted(dir.iterdir()):
-                if abort_signal_file.exists():
-                    break
-                transcribe(network_args, f)
+        text = transcribe_file(network_args, transcription_target, token)
         if text:
             conn.sendall(text.encode())
 
+    elif network_args.profile is not None:
+        logging.info('Received profile command.')
+        if network_args.profile <= 0:
+            msg = f'--profile needs a positive N, not {network_args.profile:g}.'
+            logging.info(msg)
+            conn.sendall(msg.encode())
+            return
+        report_path = profile(network_args, token)
+        logging.info(f'Wrote profile to {report_path}')
+        conn.sendall(report_path.read_bytes())
     elif network_args.test_error:
         logging.info('Received test error command.')
         raise Exception('Test Error')
@@ -461,11 +613,19 @@ def argument_branching(network_args, server_state: ServerState, conn):
         logging.info('Invalid command. Sending help.')
         send_help(conn)
 
-def connection_processor(conn, server_state):
+def is_authorized(addr, secret) -> bool:
+    """Commands from this machine are always accepted. Commands from other machines need the
+    remote_secret of the config, and are refused if it is not set."""
+    if ipaddress.ip_address(addr[0]).is_loopback:
+        return True
+    expected = config['remote_secret']
+    return expected is not None and secret is not None and hmac.compare_digest(secret.encode(), expected.encode())
+
+def connection_processor(conn, addr, server_state):
     with conn:
         msg = conn.recv(1024)
         msg = msg.decode('utf-8').strip()
-        logging.debug(f'Got message: {msg}')
+        logging.debug('Got message: ' + re.sub(r'(--secret=|--secret\S*\s+)\S+', r'\1***', msg))
 
         network_args = shlex.split(msg)
 
@@ -489,18 +649,55 @@ def connection_processor(conn, server_state):
                 except argparse.ArgumentError as e:
                     propagate_messages(f)
                     return
+        if not is_authorized(addr, network_args.secret):
+            logging.warning(f'Refused a command from {addr[0]}, it did not send the remote_secret.')
+            conn.sendall(b'Refused: commands from other machines need --secret with the remote_secret '
+                         b'of the server config.\n')
+            return
         try:
-            argument_branching(network_args, server_state, conn)
+            argument_branching(network_args, server_state, conn, server_state.new_cancellation_token())
+        except Cancelled:
+            logging.info('Session aborted.')
         except Exception as e:
             e = '\n'.join(traceback.format_exception(e))
             logging.info(e)
             conn.sendall(e.encode())
 
-        trim_audio_files()
+def load_vocabulary():
+    path = config['vocabulary_file']
+    if path is None:
+        text_processing.vocabulary = None
+        return
+    path = project_path / Path(path).expanduser()
+    try:
+        text_processing.vocabulary = Vocabulary.load(path)
+        logging.info(f'Loaded {len(text_processing.vocabulary.terms)} vocabulary terms from {path}')
+    except OSError as e:
+        logging.warning(f'Could not load the vocabulary: {e}')
+        text_processing.vocabulary = None
+
+def watch_config():
+    """Reload the config when it changes and rebuild the components that depend on changed keys.
+    The notifier, the transcription backend, paste timing and retention read the config on every use."""
+    config.subscribe(['input_device_index'],
+                     lambda: audio_capture.set_input_device(config['input_device_index']))
+    config.subscribe(['vocabulary_file'], load_vocabulary)
+    config.subscribe(['debug_log'], lambda: configure_log_file(
+        config['debug_log']['max_megabytes'], config['debug_log']['backups'], config['debug_log']['json_lines']))
+    config.subscribe(['IP', 'port', 'debug_port', 'batch_concurrency'],
+                     lambda: logging.warning('Changes of IP, port and batch_concurrency only apply after a restart.'))
+    config.watch()
 
 def connection_acceptor():
     """The main server loop for accepting connections and dispatching a thread for each of them"""
-    server_state = ServerState(False, [])
+    watch_config()
+    load_vocabulary()
+    retention_worker.start()
+    server_state = ServerState(server_sessions)
+    # Batch jobs are not cancelled by --abort, which is meant for the dictation in progress.
+    # Otherwise the running jobs would fail, while the queued ones still start afterwards.
+    server_state.batch_queue = BatchQueue(batch_queue_file, batch_transcribe_file, CancellationToken,
+                                          config['batch_concurrency']).start()
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
@@ -511,12 +708,8 @@ def connection_acceptor():
         while True:
             logging.debug('Waiting for connection')
             conn, addr = s.accept()
-            server_state.thread_infos = [t for t in server_state.thread_infos if t.thread.is_alive()]
             logging.debug(f'Processing connection from {addr}')
-            t = threading.Thread(target=connection_processor, args=[conn, server_state])
-            thread_info = ThreadInfo(t, ThreadState.RUNNING)
-            server_state.thread_infos.append(thread_info)
-            t.start()
+            threading.Thread(target=connection_processor, args=[conn, addr, server_state]).start()
     except KeyboardInterrupt as e:
         logging.debug('closing socket')
         s.close()
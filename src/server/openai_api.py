@@ -0,0 +1,139 @@
+import io
+import socket
+import threading
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import encode_multipart_formdata
+
+from cancellation import Cancelled, CancellationToken
+
+# The connect and read timeouts of a request in seconds. The read timeout bounds the
+# wait for the response after the upload, transcribing the largest upload of 25 MB can
+# take a few minutes.
+request_timeout = (10, 600)
+
+
+class _CancellableBody(io.BytesIO):
+    """A request body that stops the upload as soon as the token is cancelled.
+    The HTTP client reads the body in small blocks while sending it."""
+    def __init__(self, data, token: CancellationToken):
+        super().__init__(data)
+        self.token = token
+
+    def read(self, size=-1):
+        self.token.raise_if_cancelled()
+        return super().read(size)
+
+class _AbortableAdapter(HTTPAdapter):
+    """Keeps the connections it opens, such that abort() can shut down their sockets from another
+    thread. A request that is sending the body or waiting for the response then fails at once."""
+    def __init__(self):
+        self.connections = []
+        self.aborted = False
+        self.abort_lock = threading.Lock()
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self._make_abortable(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        self._make_abortable(manager)
+        return manager
+
+    def _make_abortable(self, manager):
+        if getattr(manager, 'abortable', False):
+            return
+        adapter = self
+        def abortable(pool_class):
+            class Connection(pool_class.ConnectionCls):
+                def connect(self):
+                    super().connect()
+                    adapter._opened(self)
+            return type(pool_class.__name__, (pool_class,), {'ConnectionCls': Connection})
+        # The pool classes are shared by all pool managers, so they are replaced and not changed.
+        manager.pool_classes_by_scheme = {
+            scheme: abortable(c) for scheme, c in manager.pool_classes_by_scheme.items()}
+        manager.abortable = True
+
+    def _opened(self, connection):
+        with self.abort_lock:
+            self.connections.append(connection)
+            if self.aborted:
+                _shutdown(connection)
+
+    def abort(self):
+        with self.abort_lock:
+            self.aborted = True
+            for connection in self.connections:
+                _shutdown(connection)
+
+def _shutdown(connection):
+    if connection.sock is None:
+        return
+    try:
+        # Not SSLSocket.shutdown, which also drops the TLS state that the requesting thread uses.
+        socket.socket.shutdown(connection.sock, socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+def transcribe_audio(audio, token: CancellationToken, model, api_key, api_base='https://api.openai.com/v1',
+                     language=None, response_format='json', timeout=request_timeout):
+    """
+    Call the OpenAI compatible /audio/transcriptions endpoint.
+
+    The request runs on a helper thread, such that the caller returns as soon as the
+    token is cancelled, instead of when the response arrives. Cancelling shuts down the
+    connection, also while waiting for the response, such that the request does not stay
+    open until the timeout.
+    @param audio: a path, or an open file object with a name attribute that has the right extension
+    @return: the parsed JSON response
+    @raise Cancelled: if the token was cancelled before the response arrived
+    """
+    token.raise_if_cancelled()
+    if isinstance(audio, (str, Path)):
+        name, data = Path(audio).name, Path(audio).read_bytes()
+    else:
+        audio.seek(0)
+        name, data = Path(audio.name).name, audio.read()
+    fields = {'model': model, 'response_format': response_format, 'file': (name, data)}
+    if language:
+        fields['language'] = language
+    body, content_type = encode_multipart_formdata(fields)
+
+    done = threading.Event()
+    result = {}
+    adapter = _AbortableAdapter()
+
+    def post():
+        try:
+            with requests.Session() as session:
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                result['response'] = session.post(
+                    f'{api_base}/audio/transcriptions', data=_CancellableBody(body, token), timeout=timeout,
+                    headers={'Authorization': f'Bearer {api_key}', 'Content-Type': content_type})
+        except BaseException as e:
+            result['error'] = e
+        finally:
+            done.set()
+
+    def cancel():
+        adapter.abort()
+        done.set()
+
+    unregister = token.on_cancel(cancel)
+    threading.Thread(target=post, daemon=True).start()
+    done.wait()
+    unregister()
+    if token.cancelled:
+        raise Cancelled()
+    if 'error' in result:
+        raise result['error']
+    response = result['response']
+    if response.status_code != 200:
+        raise Exception(f'Transcription request failed with {response.status_code}: {response.text}')
+    return response.json()
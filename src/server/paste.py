@@ -1,14 +1,15 @@
 import logging
 import subprocess
 import sys
-import threading
 import time
 from pynput.keyboard import Key, Controller
 
 import pyperclip
 
-from data_structures import ThreadState
-from config import config
+from config import config, paste_timings_file
+from selection import PasteTimings, SelectionServer
+
+paste_timings = PasteTimings(paste_timings_file)
 
 terminal_names = ['alacritty', 'gnome-terminal', 'xterm', 'konsole', 'kitty', 'terminator', 'guake', 'tilix', 'terminology', 'cool-retro-term', 'tilda', 'terminix', 'terminator', 'xfce4-terminal', 'mate-terminal', 'lxterminal', 'sakura', 'eterm', 'rxvt', 'urxvt', 'st', 'qterminal', 'lilyterm', 'terminator', 'terminator-gtk3', 'terminator-gtk2', 'terminator-gnome', 'terminator-xfce', 'terminator-k']
 
@@ -25,37 +26,35 @@ def _X_get_window_name():
     return subprocess.check_output([r"""xprop -id $(xdotool getwindowfocus) | sed -n 's/WM_CLASS.*= "\([^"]*\).*/\1/p'"""], shell=True).decode().strip()
 
 def _X_paste_text(text):
+    """Paste by serving the text on the selections and pressing the paste keys. The clipboard
+    is restored as soon as the target application requested the text, see SelectionServer."""
     logging.debug(f'Using X paste')
     clipboard_contents = _X_get_clipboard()
     #subprocess.run(['xdotool', 'type', text])
     program = _X_get_window_name()
-    subprocess.run(['xclip', '-selection', 'primary'], input=text.encode(), check=True)
     logging.debug(f'program is: {program}')
-    if program.lower() in ['emacs', 'kitty', 'obsidian']:
-        # Use Shift+Insert
-        logging.debug(f'Using X paste')
-        subprocess.run(['xclip', '-selection', 'clipboard'], input=(text).encode(), check=True)
-    
-        subprocess.check_output(['xdotool', 'key', '--clearmodifiers', 'Shift+Insert'])
-        
-        time.sleep(config['paste_wait'])
-        time.sleep(config['paste_wait'])
-        subprocess.run(['xclip', '-selection', 'clipboard'], input=clipboard_contents.encode(), check=True)
-    elif program.lower() in [*terminal_names, 'code']:
-        _pyperclip_paste_text(text)
-        # Use Shift+Ctrl+v
-        #logging.debug(f'X paste: obsidian or VScode')
-        #subprocess.run(['xclip', '-selection', 'clipboard'], input=(text).encode(), check=True)
-        #subprocess.run(['xdotool', 'key', '--clearmodifiers', 'Shift+Ctrl+V'], check=True)
-        #time.sleep(1)
-        #subprocess.run(['xclip', '-selection', 'clipboard'], input=clipboard_contents.encode(), check=True)
+    shift_insert = program.lower() in ['emacs', 'kitty', 'obsidian']
+    # Shift+Insert pastes the primary selection in some applications.
+    server = SelectionServer(['clipboard', 'primary'] if shift_insert else ['clipboard'], text)
+    try:
+        sent = time.monotonic()
+        if shift_insert:
+            subprocess.check_output(['xdotool', 'key', '--clearmodifiers', 'Shift+Insert'])
+        else:
+            keyboard = Controller()
+            with keyboard.pressed(Key.ctrl):
+                keyboard.press('v')
+        served = server.wait_until_served(sent, config['paste_timeout'], paste_timings.settle(program))
+    finally:
+        server.close()
+    if served:
+        logging.debug(f'{program} requested the text after {served[0]:.3f}s to {served[1]:.3f}s')
+        paste_timings.record(program, *served)
     else:
-        _pyperclip_paste_text(text)
-        # Use Ctrl+v
-        # subprocess.run(['xclip', '-selection', 'clipboard'], input=text.encode(), check=True)
-        # subprocess.run(['xdotool', 'key', '--clearmodifiers', 'Ctrl+v'], check=True)
-        # time.sleep(0.25)
-        # subprocess.run(['xclip', '-selection', 'clipboard'], input=clipboard_contents.encode(), check=True)
+        logging.warning(f'{program} did not request the text within {config["paste_timeout"]}s')
+    # The text stays in the primary selection, like after selecting it.
+    subprocess.run(['xclip', '-selection', 'primary'], input=text.encode(), check=True)
+    subprocess.run(['xclip', '-selection', 'clipboard'], input=clipboard_contents.encode(), check=True)
 
 def _pyperclip_paste_text(text):
     logging.debug(f'Using Pyperclip')
@@ -83,15 +82,8 @@ def paste_text(args, text, server_state):
     This function selects the appropriate method for the current platform, and Application.
     """
     logging.debug(f'Pasting Text')
-    if args.no_insertion:
+    if args.no_insertion or getattr(args, 'only_record', False):
         return
-    for i in server_state.thread_infos:
-        logging.debug(f'In paste function server state thread info: {i.thread}')
-        logging.debug(f'In paste function current thread: {threading.current_thread()}')
-        if i.thread_state == ThreadState.ABORTION_REQUESTED and threading.current_thread() is i.thread:
-            logging.debug(f'Processing abortion request, in paste function of thread {i}')
-            i.thread_state = ThreadState.ABORTION_PROCESSED
-            return
     if args.clipboard:
         pyperclip.copy(text)
     elif sys.platform == 'linux':
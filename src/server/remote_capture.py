@@ -0,0 +1,188 @@
+"""
+Stream audio from a thin client to a central server, which transcribes it and returns the text.
+
+Protocol, after the client sent the usual command line with --remote-capture:
+    server -> client: READY\\n
+    client -> server: frames, each a 4 byte big endian length followed by a FLAC encoded
+                      block of 16 kHz mono audio. A frame of length 0 ends the recording.
+    server -> client: OK\n followed by the post-processed transcription, or ERR\n followed
+                      by the error, then the server closes the connection.
+
+Run this module on the client machine to record from its microphone until Enter or
+Ctrl-C is pressed, and paste the text there. With --input-file a file is streamed instead,
+which allows testing against a local server.
+"""
+import argparse
+import io
+import shlex
+import signal
+import socket
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+import soundfile as sf
+
+from cancellation import Cancelled, CancellationToken
+
+READY = b'READY\n'
+OK = b'OK\n'
+ERR = b'ERR\n'
+# How long the server waits for the next frame, before it gives up on the client.
+receive_timeout = 30
+sample_rate = 16000
+frame_samples = sample_rate // 4
+
+
+def encode_frame(samples: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    sf.write(buf, samples, sample_rate, format='FLAC', subtype='PCM_16')
+    payload = buf.getvalue()
+    return struct.pack('>I', len(payload)) + payload
+
+def end_frame() -> bytes:
+    return struct.pack('>I', 0)
+
+def _recv_exact(conn: socket.socket, n: int) -> bytes:
+    data = bytearray()
+    while len(data) < n:
+        part = conn.recv(n - len(data))
+        if not part:
+            raise ConnectionError('Remote client closed the connection during the recording')
+        data += part
+    return bytes(data)
+
+def receive_audio(conn: socket.socket, on_frame: Callable[[np.ndarray], None] = lambda samples: None,
+                  timeout: float = receive_timeout) -> np.ndarray:
+    """Receive frames until the end frame. @return: the received audio as 16 bit PCM at sample_rate
+    @raise socket.timeout: if no data arrived for timeout seconds"""
+    conn.settimeout(timeout)
+    blocks = []
+    while True:
+        length, = struct.unpack('>I', _recv_exact(conn, 4))
+        if length == 0:
+            break
+        samples, _ = sf.read(io.BytesIO(_recv_exact(conn, length)), dtype='int16')
+        blocks.append(samples)
+        on_frame(samples)
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int16)
+
+def serve_recording(conn: socket.socket, token: CancellationToken, transcribe: Callable[[np.ndarray], str],
+                    timeout: float = receive_timeout) -> str:
+    """The server side of a --remote-capture connection: receive the recording, and reply with
+    OK and transcribe(samples), or with ERR if that failed. Cancelling the token closes the connection.
+    @return: the transcription
+    @raise Cancelled: if the token was cancelled"""
+    def close_connection():
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    try:
+        conn.sendall(READY)
+        unregister = token.on_cancel(close_connection)
+        try:
+            samples = receive_audio(conn, timeout=timeout)
+        except (ConnectionError, OSError):
+            token.raise_if_cancelled()
+            raise
+        finally:
+            unregister()
+        text = transcribe(samples)
+    except BaseException as e:
+        # The client only pastes replies that start with OK.
+        try:
+            conn.sendall(ERR + (b'Aborted' if isinstance(e, Cancelled) else b''))
+        except OSError:
+            pass
+        raise
+    conn.sendall(OK + text.encode())
+    return text
+
+def rechunk(blocks: Iterator[np.ndarray], size: int = frame_samples) -> Iterator[np.ndarray]:
+    buffer = np.zeros(0, dtype=np.int16)
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= size:
+            yield buffer[:size]
+            buffer = buffer[size:]
+    if len(buffer):
+        yield buffer
+
+def microphone_blocks(stop: threading.Event) -> Iterator[np.ndarray]:
+    import pyaudio
+    p = pyaudio.PyAudio()
+    stream = p.open(format=pyaudio.paInt16, channels=1, rate=sample_rate, input=True,
+                    frames_per_buffer=frame_samples)
+    try:
+        while not stop.is_set():
+            yield np.frombuffer(stream.read(frame_samples, exception_on_overflow=False), dtype=np.int16)
+    finally:
+        stream.close()
+        p.terminate()
+
+def stream_to_server(host: str, port: int, server_args, blocks: Iterator[np.ndarray]) -> str:
+    """Send the audio to the server. @return: the transcription
+    @raise Exception: with the message of the server if it failed"""
+    command = ['--working-dir', str(Path.cwd()), '--remote-capture', *server_args]
+    with socket.create_connection((host, port)) as conn:
+        conn.sendall(' '.join(shlex.quote(a) for a in command).encode())
+        response = _recv_exact(conn, len(READY))
+        if response != READY:
+            # The server rejected the command, e.g. with the help text.
+            raise Exception((response + conn.recv(65536)).decode())
+        for samples in rechunk(blocks):
+            conn.sendall(encode_frame(samples))
+        conn.sendall(end_frame())
+        reply = bytearray()
+        while part := conn.recv(65536):
+            reply += part
+    if not reply.startswith(OK):
+        raise Exception(reply.removeprefix(ERR).decode() or 'The server closed the connection without a reply')
+    return reply[len(OK):].decode()
+
+if __name__ == '__main__':
+    from config import config
+
+    parser = argparse.ArgumentParser(description='Record on this machine and transcribe on a central server.')
+    parser.add_argument('--host', default=config['IP'], help='The server to send the audio to.')
+    parser.add_argument('--port', type=int, default=config['port'])
+    parser.add_argument('--secret', default=config['remote_secret'],
+        help='The remote_secret of the server config. Defaults to remote_secret of the local config.')
+    parser.add_argument('--input-file', type=Path,
+        help='Stream this audio file instead of recording from the microphone.')
+    parser.add_argument('--no-postprocessing', action='store_true')
+    parser.add_argument('--start-lowercase', action='store_true')
+    parser.add_argument('--clipboard', action='store_true', help="Don't paste, only copy to clipboard.")
+    parser.add_argument('--std-out', action='store_true', help="Don't paste, only output to stdout.")
+    args = parser.parse_args()
+
+    server_args = ['--notifier-system', 'no-popup']
+    if args.secret:
+        server_args += ['--secret', args.secret]
+    server_args += [flag for flag, on in [('--no-postprocessing', args.no_postprocessing),
+                                          ('--start-lowercase', args.start_lowercase)] if on]
+    if args.input_file:
+        from audio_decoding import decode_pcm_blocks
+        blocks = decode_pcm_blocks(args.input_file, sample_rate)
+    else:
+        stop = threading.Event()
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        threading.Thread(target=lambda: (sys.stdin.readline(), stop.set()), daemon=True).start()
+        print('Recording, press Enter to stop.', file=sys.stderr)
+        blocks = microphone_blocks(stop)
+
+    try:
+        text = stream_to_server(args.host, args.port, server_args, blocks)
+    except Exception as e:
+        print(f'Transcription failed: {e}', file=sys.stderr)
+        sys.exit(1)
+    if args.std_out:
+        print(text)
+    else:
+        from paste import paste_text
+        paste_text(argparse.Namespace(no_insertion=False, clipboard=args.clipboard), text, None)
@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Set
+
+from audio_decoding import recompress
+
+# Recompressed recordings are Opus in an Ogg container, named .ogg as the transcription
+# API does not accept .opus.
+recording_extensions = ['.mp3', '.ogg']
+
+
+def list_recordings(audio_dir: Path) -> List[Path]:
+    """All recordings, oldest first. Recompressed recordings keep their name, only the extension changes."""
+    paths = [p for ext in recording_extensions for p in audio_dir.glob(f'*{ext}')]
+    return sorted(paths, key=lambda p: p.stem)
+
+class RetentionWorker:
+    """
+    Applies the audio retention policy in a background thread, off the request path.
+
+    Recordings older than recompress_after_hours are re-encoded to low bitrate Opus,
+    one at a time with a pause in between, such that the worker never competes with a
+    transcription for long. Recordings older than max_age_days are deleted, and the
+    oldest recordings are deleted while the directory is larger than max_megabytes.
+
+    @param get_policy: returns the current audio_retention config section
+    """
+    def __init__(self, audio_dir: Path, get_policy: Callable[[], dict], interval: float = 600):
+        self.audio_dir = audio_dir
+        self.get_policy = get_policy
+        self.interval = interval
+        self.wake = threading.Event()
+        # Recordings that could not be recompressed, e.g. because they are corrupt. They are
+        # not tried again, but still deleted by age and size.
+        self.failed: Set[Path] = set()
+        self.thread = threading.Thread(target=self._run, name='audio-retention', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def notify(self):
+        """Apply the policy soon, e.g. after a new recording was saved."""
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.apply()
+            except Exception:
+                logging.exception('Applying the audio retention policy failed')
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def apply(self):
+        policy = self.get_policy()
+        now = time.time()
+        recordings = list_recordings(self.audio_dir)
+        self.failed.intersection_update(recordings)
+        for path in recordings:
+            # One broken recording must not stop the policy for all others.
+            try:
+                age = now - path.stat().st_mtime
+                if age > policy['max_age_days'] * 24 * 3600:
+                    logging.debug(f'Deleting {path.name}, older than {policy["max_age_days"]} days')
+                    path.unlink()
+                elif (path.suffix == '.mp3' and age > policy['recompress_after_hours'] * 3600
+                      and path not in self.failed):
+                    self._recompress(path, policy['recompress_bitrate'])
+                    time.sleep(policy['throttle_seconds'])
+            except Exception as e:
+                logging.warning(f'Could not apply the retention policy to {path.name}, skipping it: {e!r}')
+                self.failed.add(path)
+
+        recordings = list_recordings(self.audio_dir)
+        sizes = [p.stat().st_size for p in recordings]
+        total, budget = sum(sizes), policy['max_megabytes'] * 1024 * 1024
+        for path, size in zip(recordings, sizes):
+            if total <= budget or now - path.stat().st_mtime < 60:
+                # Recordings of the last minute might still be in use.
+                break
+            logging.debug(f'Deleting {path.name}, audio directory is over budget')
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _recompress(self, path: Path, bitrate: int):
+        target = path.with_suffix('.ogg')
+        tmp = path.with_suffix('.ogg.tmp')
+        try:
+            recompress(path, tmp, bitrate)
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            raise
+        # Keep the modification time, such that the age of the recording is preserved.
+        stat = path.stat()
+        tmp.replace(target)
+        os.utime(target, (stat.st_atime, stat.st_mtime))
+        logging.debug(f'Recompressed {path.name}: {stat.st_size} -> {target.stat().st_size} bytes')
+        path.unlink()
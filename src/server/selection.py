@@ -0,0 +1,98 @@
+import json
+import logging
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# How long to wait for further requests after the last one, until the timings of an
+# application were learned. Many applications first request the TARGETS and then the text.
+default_settle = 0.1
+min_settle = 0.05
+
+
+class SelectionServer:
+    """
+    Serves text on X selections with xclip in the foreground, and watches the requests
+    of other applications for it. xclip -verbose prints a line before it waits for every
+    request, so every line after the first one means that a request was served.
+    """
+    def __init__(self, selections: List[str], text: str):
+        self.requests: List[float] = []
+        self.cond = threading.Condition()
+        self.processes = []
+        for selection in selections:
+            process = subprocess.Popen(['xclip', '-selection', selection, '-verbose'],
+                                       stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE, text=True)
+            owned = threading.Event()
+            threading.Thread(target=self._watch, args=[process, owned], name=f'xclip-{selection}',
+                             daemon=True).start()
+            process.stdin.write(text) # type: ignore
+            process.stdin.close() # type: ignore
+            # xclip reads all input before it takes the selection.
+            owned.wait(1)
+            self.processes.append(process)
+
+    def _watch(self, process: subprocess.Popen, owned: threading.Event):
+        for line in process.stderr: # type: ignore
+            if 'Waiting for selection request number' in line:
+                owned.set()
+                if int(line.split()[-1]) > 1:
+                    with self.cond:
+                        self.requests.append(time.monotonic())
+                        self.cond.notify_all()
+        owned.set()
+
+    def wait_until_served(self, sent: float, timeout: float, settle: float) -> Optional[Tuple[float, float]]:
+        """Wait for the first request, and then until there was no further request for settle seconds.
+        @param sent: the time.monotonic() when the paste keys were pressed
+        @return: when the first and the last request were served, relative to sent,
+            or None if there was no request within timeout seconds"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.requests, sent + timeout - time.monotonic()):
+                return None
+            while True:
+                n = len(self.requests)
+                if not self.cond.wait_for(lambda: len(self.requests) > n,
+                                          self.requests[-1] + settle - time.monotonic()):
+                    return self.requests[0] - sent, self.requests[-1] - sent
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+
+class PasteTimings:
+    """
+    The learned spread between the first and the last selection request of a paste, per
+    application, cached on disk. It determines how long to wait for follow-up requests,
+    such that the clipboard is restored as early as possible for fast applications.
+    """
+    def __init__(self, file: Path):
+        self.file = file
+        self.lock = threading.Lock()
+        try:
+            self.timings: Dict[str, Dict[str, float]] = json.loads(file.read_text())
+        except (OSError, ValueError):
+            self.timings = {}
+
+    def settle(self, app: str) -> float:
+        """@return: how long to wait for a further request after a request"""
+        timing = self.timings.get(app)
+        if timing is None:
+            return default_settle
+        return max(min_settle, timing['spread'] * 1.5)
+
+    def record(self, app: str, first: float, last: float):
+        """Learn from a paste whose requests were served first and last seconds after the keys were pressed."""
+        with self.lock:
+            timing = self.timings.setdefault(app, {'spread': last - first, 'count': 0})
+            # The spread is only used for waiting, so it should rather be too long.
+            timing['spread'] = max(last - first, 0.9 * timing['spread'] + 0.1 * (last - first))
+            timing['count'] += 1
+            try:
+                self.file.parent.mkdir(parents=True, exist_ok=True)
+                self.file.write_text(json.dumps(self.timings, indent=2))
+            except OSError as e:
+                logging.warning(f'Could not save the paste timings: {e}')
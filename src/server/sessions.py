@@ -0,0 +1,111 @@
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from cancellation import CancellationToken
+from data_structures import SessionState
+from endpointing import EndpointDetector
+
+
+def inserts(network_args) -> bool:
+    """Whether the text of a session is pasted or copied, which has to happen in order."""
+    return not (network_args.std_out or network_args.no_insertion or network_args.only_record)
+
+class RecordingSession:
+    """
+    One dictation, from capture to delivery of the text.
+
+    Each session has its own capture buffer and stop and pause state, such that a new
+    session can record while earlier ones are still transcribing.
+    """
+    def __init__(self, seq: int, network_args, token: CancellationToken):
+        self.seq = seq
+        self.id = f'{seq:04d}'
+        self.network_args = network_args
+        self.token = token
+        self.frames = []
+        self.on_chunk: Optional[Callable[[bytes], None]] = None
+        # If set, the session stops by itself at the end of the utterance.
+        self.endpointer: Optional[EndpointDetector] = None
+        self.state = SessionState.RECORDING
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.paused = threading.Event()
+        token.on_cancel(self.stopped.set)
+
+    def add_chunk(self, data: bytes):
+        """Called by the capture thread with every chunk of audio."""
+        if self.paused.is_set() or self.stopped.is_set():
+            return
+        self.frames.append(data)
+        if self.on_chunk:
+            self.on_chunk(data)
+        if self.endpointer and self.endpointer.feed(data):
+            logging.info(f'End of speech detected, stopping session {self.id}')
+            self.stopped.set()
+
+    def __str__(self):
+        return f'{self.id} {self.state.name.lower()} ({time.time() - self.started:.1f}s)'
+
+class SessionManager:
+    """
+    Keeps track of all sessions in flight, and of the one that is recording.
+
+    Sessions are numbered in the order they were started. Their results are delivered
+    in the same order: wait_for_turn blocks until all earlier sessions that insert their
+    text finished. Sessions that don't insert, e.g. with --no-insertion, never block others.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.counter = itertools.count()
+        self.sessions: Dict[int, RecordingSession] = {}
+        self.recording: Optional[RecordingSession] = None
+        self.finished_count = 0
+
+    def toggle(self, network_args, token: CancellationToken) -> Tuple[Optional[RecordingSession], bool]:
+        """Stop the session that is recording, or start a new one if none is. With --start
+        a session is only started, with --stop only stopped. The check and the change are
+        atomic, such that two toggles that arrive together, e.g. from a double pressed
+        hotkey, don't both start a session.
+        @return: the started or stopped session or None, and whether it was started"""
+        with self.cond:
+            if self.recording and not network_args.start:
+                session, self.recording = self.recording, None
+                session.stopped.set()
+                return session, False
+            if not self.recording and not network_args.stop:
+                session = RecordingSession(next(self.counter), network_args, token)
+                self.sessions[session.seq] = session
+                self.recording = session
+                return session, True
+            return None, False
+
+    def recording_finished(self, session: RecordingSession):
+        with self.cond:
+            if self.recording is session:
+                self.recording = None
+
+    def wait_for_turn(self, session: RecordingSession):
+        """Block until all sessions that were started before this one finished."""
+        with self.cond:
+            self.cond.wait_for(lambda: min(seq for seq, s in self.sessions.items()
+                                           if s is session or inserts(s.network_args)) == session.seq)
+
+    def finish(self, session: RecordingSession, state: SessionState):
+        with self.cond:
+            session.state = state
+            self.finished_count += 1
+            self.sessions.pop(session.seq, None)
+            if self.recording is session:
+                self.recording = None
+            self.cond.notify_all()
+
+    def status(self) -> str:
+        with self.cond:
+            sessions = list(self.sessions.values())
+        msg = f"Sessions in flight: {len(sessions)}\n"
+        for session in sessions:
+            msg += f"  {session}\n"
+        return msg
@@ -0,0 +1,66 @@
+"""
+Stand-ins for the microphone and the transcription API, used by the server with
+--stub-backends, such that it can be load tested without audio hardware, API keys or cost.
+"""
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import soundfile as sf
+
+from cancellation import Cancelled, CancellationToken
+
+
+class SilentCapture:
+    """Has the interface of AudioCapture, but captures silence in real time."""
+    def __init__(self, rate=44100, chunk=1024*4):
+        self.rate = rate
+        self.chunk = chunk
+        self.subscribers: List[Callable[[bytes], None]] = []
+        self.excluded_windows: Callable[[float, float], List[Tuple[float, float]]] = lambda start, end: []
+        self.lock = threading.Lock()
+        self.reader = None
+
+    def set_input_device(self, input_device_index):
+        pass
+
+    def subscribe(self, callback: Callable[[bytes], None]):
+        with self.lock:
+            self.subscribers.append(callback)
+            if self.reader is None:
+                self.reader = threading.Thread(target=self._read, name='audio-capture', daemon=True)
+                self.reader.start()
+
+    def unsubscribe(self, callback: Callable[[bytes], None]):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def _read(self):
+        silence = bytes(2 * self.chunk)
+        next_chunk = time.monotonic()
+        while True:
+            next_chunk += self.chunk / self.rate
+            time.sleep(max(0, next_chunk - time.monotonic()))
+            with self.lock:
+                if not self.subscribers:
+                    self.reader = None
+                    return
+                subscribers = list(self.subscribers)
+            for callback in subscribers:
+                callback(silence)
+
+    def close(self):
+        pass
+
+def stub_transcribe_audio(audio, token: CancellationToken, base_latency=0.3, realtime_factor=0.05, **backend):
+    """Answer like transcribe_audio after a delay that grows with the audio duration.
+    @param backend: the backend arguments of transcribe_audio, ignored
+    @raise Cancelled: if the token is cancelled before the answer"""
+    duration = sf.info(audio).duration
+    if not isinstance(audio, (str, Path)):
+        audio.seek(0)
+    if token.wait(base_latency + realtime_factor * duration):
+        raise Cancelled()
+    return {'text': f'Stub transcription of {duration:.1f} seconds.'}
@@ -1,6 +1,11 @@
 import logging
 import re
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+
+from vocabulary import Vocabulary
+
+# Set by the server from the vocabulary_file in the config.
+vocabulary: Optional[Vocabulary] = None
 
 
 def _text_substitution(s):
@@ -107,6 +112,8 @@ def process_transcription(args, text):
     text = text.replace('\n', ' ')
     if not args.no_postprocessing:
         text = _text_substitution(text)
+        if vocabulary:
+            text = vocabulary.correct(text)
     if args.start_lowercase:
         if len(text) >= 2:
             text = text[0].lower() + text[1:]
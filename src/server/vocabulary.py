@@ -0,0 +1,148 @@
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+# Words shorter than this are only corrected if they match a term exactly,
+# e.g. in capitalization, as short words have too many close neighbours, like
+# "taken" and "Token".
+min_fuzzy_length = 7
+# The largest edit distance that is corrected, for words of 10 and more characters.
+max_edits = 2
+# Words that only differ from a term in one of these endings are inflections and not
+# misrecognitions, e.g. "parsed" or "configs".
+suffixes = ['s', 'es', 'ed', 'd', 'ing', 'er', 'ers', 'ly', 'ion', 'ions']
+# Spans of several words are not looked up across the end of a sentence or a line, e.g. in
+# "I met Jane.\n\nDoe said hi." or after a bullet inserted by a dictation command.
+sentence_break = re.compile(r'[.!?;:]\s|\n')
+
+
+def normalize(text: str) -> str:
+    """The lookup key of a term or a span of the transcript, ignoring case, spaces and punctuation."""
+    return re.sub(r'[\W_]+', '', text.lower())
+
+def max_distance(key: str) -> int:
+    if len(key) < min_fuzzy_length:
+        return 0
+    return 1 if len(key) < 10 else max_edits
+
+def stems(word: str) -> Set[str]:
+    found = {word} | {word[:-len(s)] for s in suffixes if word.endswith(s)}
+    return found | {w[:-1] for w in found if w.endswith('e')}
+
+def is_inflection(a: str, b: str) -> bool:
+    """Whether a and b are forms of the same word, e.g. "parse" and "parsing"."""
+    return bool(stems(a) & stems(b))
+
+def bounded_distance(a: str, b: str, bound: int) -> int:
+    """The Levenshtein distance of a and b, or bound + 1 if it is larger than bound."""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return min(previous[-1], bound + 1)
+
+def deletions(key: str, depth: int) -> Set[str]:
+    """@return: key and all strings that result from deleting up to depth characters of it"""
+    found = {key}
+    level = {key}
+    for _ in range(depth):
+        level = {k[:i] + k[i + 1:] for k in level for i in range(len(k))}
+        found |= level
+    return found
+
+class DeletionIndex:
+    """
+    A symmetric deletion index over the keys. Two strings within edit distance d share a
+    string that results from deleting at most d characters of each. All deletions of the
+    keys are precomputed, so a lookup only generates the deletions of the query and
+    verifies the few keys found under them, independent of the number of keys.
+    """
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.index: Dict[str, Set[str]] = defaultdict(set)
+
+    def add(self, key: str):
+        for deletion in deletions(key, self.depth):
+            self.index[deletion].add(key)
+
+    def search(self, key: str, radius: int) -> List[Tuple[int, str]]:
+        """@return: (distance, key) of all keys within the radius, which is at most the depth"""
+        candidates = set()
+        for deletion in deletions(key, radius):
+            candidates |= self.index.get(deletion, set())
+        found = [(bounded_distance(key, c, radius), c) for c in candidates]
+        return [(d, c) for d, c in found if d <= radius]
+
+class Vocabulary:
+    """
+    Corrects misrecognised names, jargon and identifiers to the terms of a vocabulary file,
+    one term per line. Terms can have several words, e.g. "Jane Doe" or "system-wide-whisper".
+
+    Spans of one to as many words as the longest term are looked up by their normalized
+    form, first exactly in a dict, then in a DeletionIndex within an edit distance that
+    grows with the length. Longer spans are tried first, and the closest term wins.
+    """
+    def __init__(self, terms: List[str]):
+        self.terms: Dict[str, str] = {}
+        self.words: Dict[str, int] = {}
+        self.index = DeletionIndex(max_edits)
+        self.max_words = 1
+        for term in terms:
+            key = normalize(term)
+            if not key or key in self.terms:
+                continue
+            self.terms[key] = term
+            # "system-wide-whisper" is transcribed as three words.
+            self.words[key] = len(re.findall(r'[^\W_]+', term))
+            self.index.add(key)
+            self.max_words = max(self.max_words, self.words[key])
+
+    @classmethod
+    def load(cls, path: Path) -> 'Vocabulary':
+        lines = [l.strip() for l in path.read_text().splitlines()]
+        return cls([l for l in lines if l and not l.startswith('#')])
+
+    def lookup(self, span: str, words: int) -> Optional[str]:
+        """Fuzzy matches must have as many words as the term, such that a neighbouring
+        word is not swallowed, e.g. "a bk tree" is not corrected to "BK-tree"."""
+        key = normalize(span)
+        if not key:
+            return None
+        if key in self.terms:
+            return self.terms[key]
+        radius = max_distance(key)
+        if radius == 0:
+            return None
+        found = [(d, k) for d, k in self.index.search(key, radius)
+                 if self.words[k] == words and not is_inflection(key, k)]
+        return self.terms[min(found)[1]] if found else None
+
+    def correct(self, text: str) -> str:
+        words = list(re.finditer(r'\S+', text))
+        out = []
+        last_end = 0
+        i = 0
+        while i < len(words):
+            for n in range(min(self.max_words, len(words) - i), 0, -1):
+                first, last = words[i], words[i + n - 1]
+                # Keep the punctuation around the span, e.g. a trailing comma.
+                span = re.match(r'^(\W*)(.*?)(\W*)$', text[first.start():last.end()], re.DOTALL)
+                if n > 1 and sentence_break.search(span.group(2)): # type: ignore
+                    continue
+                term = self.lookup(span.group(2), n) # type: ignore
+                if term:
+                    out.append(text[last_end:first.start()] + span.group(1) + term + span.group(3)) # type: ignore
+                    last_end = last.end()
+                    i += n
+                    break
+            else:
+                i += 1
+        out.append(text[last_end:])
+        return ''.join(out)
@@ -0,0 +1,96 @@
+import asyncio
+import base64
+import json
+import threading
+
+import pytest
+from websockets.asyncio.server import serve
+
+from assembly_ai import AssemblyAIStreamer
+
+rate = 16000
+
+
+class StubServer:
+    """
+    A local stand-in for the AssemblyAI real-time endpoint. Every audio message is
+    answered with a partial transcript, and every second one also with a final
+    transcript of the number of bytes received so far.
+    """
+    def __init__(self, terminate=True):
+        self.terminate = terminate
+        self.received = bytearray()
+        self.loop = asyncio.new_event_loop()
+        self.stopped = None
+        started = threading.Event()
+        self.thread = threading.Thread(target=self.loop.run_until_complete,
+                                       args=[self._serve(started)], daemon=True)
+        self.thread.start()
+        started.wait()
+
+    async def _serve(self, started):
+        self.stopped = asyncio.Event()
+        async with serve(self._handle, 'localhost', 0) as server:
+            self.url = f'ws://localhost:{server.sockets[0].getsockname()[1]}'
+            started.set()
+            await self.stopped.wait()
+
+    async def _handle(self, ws):
+        await ws.send(json.dumps({'message_type': 'SessionBegins'}))
+        messages = 0
+        async for message in ws:
+            res = json.loads(message)
+            if 'audio_data' in res:
+                self.received += base64.b64decode(res['audio_data'])
+                messages += 1
+                await ws.send(json.dumps({'message_type': 'PartialTranscript', 'text': 'partial'}))
+                if messages % 2 == 0:
+                    await ws.send(json.dumps({'message_type': 'FinalTranscript',
+                                              'text': f'final {len(self.received)}'}))
+            elif res.get('terminate_session') and self.terminate:
+                await ws.send(json.dumps({'message_type': 'FinalTranscript', 'text': 'last'}))
+                await ws.send(json.dumps({'message_type': 'SessionTerminated'}))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.stopped.set)
+        self.thread.join()
+
+@pytest.fixture
+def server():
+    server = StubServer()
+    yield server
+    server.close()
+
+@pytest.fixture
+def hanging_server():
+    server = StubServer(terminate=False)
+    yield server
+    server.close()
+
+def stream(url, chunks, timeout=10):
+    delivered = []
+    streamer = AssemblyAIStreamer('key', rate, delivered.append, url=url).start()
+    for chunk in chunks:
+        streamer.feed(chunk)
+    return streamer, delivered, lambda: streamer.finish(timeout)
+
+def test_delivers_final_phrases_in_order(server):
+    # 0.1 s per chunk, such that every chunk is sent as it is.
+    chunk = bytes(int(rate * 0.1) * 2)
+    _, delivered, finish = stream(server.url, [chunk] * 4)
+    assert finish() == 'final 6400 final 12800 last'
+    assert delivered == ['final 6400', 'final 12800', 'last']
+    assert len(server.received) == 4 * len(chunk)
+
+def test_buffers_short_chunks(server):
+    # 0.25 s in 10 ms chunks is sent as two full messages of 0.1 s and the rest.
+    _, delivered, finish = stream(server.url, [bytes(320)] * 25)
+    assert finish() == 'final 6400 last'
+    assert len(server.received) == 25 * 320
+
+def test_finish_raises_if_the_session_does_not_terminate(hanging_server):
+    streamer, _, finish = stream(hanging_server.url, [bytes(3200)], timeout=0.5)
+    with pytest.raises(TimeoutError):
+        finish()
+    streamer._thread.join(5)
+    assert not streamer._thread.is_alive()
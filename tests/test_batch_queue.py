@@ -0,0 +1,35 @@
+import json
+
+from batch_queue import BatchQueue, is_batch_pattern
+from data_structures import JobState
+
+
+def test_existing_file_with_glob_characters_is_not_a_pattern(tmp_path):
+    (tmp_path / 'Meeting [2024].mp3').write_bytes(b'')
+    assert not is_batch_pattern('Meeting [2024].mp3', tmp_path)
+
+def test_patterns_and_directories(tmp_path):
+    assert is_batch_pattern('*.mp3', tmp_path)
+    assert is_batch_pattern('Meeting [2024].mp3', tmp_path)
+    assert is_batch_pattern('.', tmp_path)
+    assert not is_batch_pattern('memo.mp3', tmp_path)
+
+def new_queue(queue_file):
+    return BatchQueue(queue_file, lambda *args: '', lambda: None)
+
+def test_resumes_interrupted_jobs(tmp_path):
+    audio = tmp_path / 'a.mp3'
+    audio.write_bytes(b'audio')
+    queue_file = tmp_path / 'batch_queue.json'
+    new_queue(queue_file).enqueue([audio], {})
+    data = json.loads(queue_file.read_text())
+    data[0]['state'] = 'RUNNING'
+    queue_file.write_text(json.dumps(data))
+    assert new_queue(queue_file).jobs[str(audio)].state == JobState.QUEUED
+
+def test_corrupt_queue_file_is_moved_aside(tmp_path):
+    queue_file = tmp_path / 'batch_queue.json'
+    queue_file.write_text('[{"path": "a.mp3", "sta')
+    assert new_queue(queue_file).jobs == {}
+    assert not queue_file.exists()
+    assert (tmp_path / 'batch_queue.json.corrupt').read_text() == '[{"path": "a.mp3", "sta'
@@ -0,0 +1,33 @@
+import numpy as np
+
+from endpointing import EndpointDetector
+
+rate = 16000
+
+
+def noise(seconds, level=0.001):
+    rng = np.random.default_rng(0)
+    return (rng.normal(0, level, int(rate * seconds)) * 32768).astype(np.int16)
+
+def speech(seconds):
+    t = np.arange(int(rate * seconds)) / rate
+    return (0.1 * np.sin(2 * np.pi * 200 * t) * 32768).astype(np.int16) + noise(seconds)
+
+def stop_time(audio, chunk=4096):
+    """@return: the time at which the detector ended the utterance, or None"""
+    detector = EndpointDetector(rate, trailing_silence=1.0, min_utterance=0.5, threshold_db=12)
+    for start in range(0, len(audio), chunk):
+        if detector.feed(audio[start:start + chunk].tobytes()):
+            return (start + chunk) / rate
+    return None
+
+def test_stops_after_trailing_silence():
+    t = stop_time(np.concatenate([noise(0.5), speech(1), noise(3)]))
+    assert t is not None and 2.5 <= t <= 2.8
+
+def test_stops_without_leading_silence():
+    t = stop_time(np.concatenate([speech(1), noise(3)]))
+    assert t is not None and 2.0 <= t <= 2.3
+
+def test_short_utterance_does_not_stop():
+    assert stop_time(np.concatenate([noise(0.5), speech(0.2), noise(3)])) is None
@@ -0,0 +1,34 @@
+import time
+
+from cancellation import CancellationToken
+from hedging import HedgedTranscriber, LatencyTracker
+
+
+def test_default_threshold_scales_with_the_audio_duration():
+    tracker = LatencyTracker()
+    assert tracker.threshold(1200, 0.95, 10, 0.5) == 600
+    assert tracker.threshold(0.2, 0.95, 10, 0.5) == 0.5
+
+def test_threshold_follows_recorded_latencies():
+    tracker = LatencyTracker()
+    for i in range(10):
+        tracker.record(0.1 * (i + 1), 10)
+    assert abs(tracker.threshold(100, 0.5, 10, 5.0) - 6.0) < 1e-9
+
+def test_long_audio_is_not_hedged_before_latencies_were_recorded():
+    backends = []
+    def transcribe(audio, token, backend):
+        backends.append(backend)
+        time.sleep(0.3)
+        return {'text': backend}
+    hedged = HedgedTranscriber(transcribe)
+    assert hedged(None, 600, CancellationToken(), 'primary', 'secondary', default_ratio=0.1)['text'] == 'primary'
+    assert backends == ['primary']
+
+def test_slow_request_is_hedged():
+    def transcribe(audio, token, backend):
+        if backend == 'primary':
+            token.wait(5)
+        return {'text': backend}
+    hedged = HedgedTranscriber(transcribe)
+    assert hedged(None, 1, CancellationToken(), 'primary', 'secondary', default_ratio=0.1)['text'] == 'secondary'
@@ -0,0 +1,63 @@
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cancellation import Cancelled, CancellationToken
+from openai_api import transcribe_audio
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers after the delay in the path, e.g. /0.5/audio/transcriptions. If the client
+    closes the connection first, the time of that is recorded instead."""
+    disconnected = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        delay = float(self.path.split('/')[1])
+        self.connection.settimeout(delay)
+        try:
+            if self.connection.recv(1) == b'':
+                Handler.disconnected.append(time.monotonic())
+                return
+        except TimeoutError:
+            pass
+        body = json.dumps({'text': 'hello'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('localhost', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    Handler.disconnected.clear()
+    yield f'http://localhost:{server.server_port}'
+    server.shutdown()
+
+def audio():
+    f = io.BytesIO(b'\0' * 1000)
+    f.name = 'a.mp3'
+    return f
+
+def test_returns_the_response(server):
+    assert transcribe_audio(audio(), CancellationToken(), 'whisper-1', 'key', api_base=f'{server}/0.1') == {'text': 'hello'}
+
+def test_cancel_closes_the_connection_while_waiting_for_the_response(server):
+    token = CancellationToken()
+    threading.Timer(0.3, token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        transcribe_audio(audio(), token, 'whisper-1', 'key', api_base=f'{server}/10')
+    assert time.monotonic() - start < 1
+    deadline = time.monotonic() + 2
+    while not Handler.disconnected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert Handler.disconnected and Handler.disconnected[0] - start < 1
@@ -0,0 +1,94 @@
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from cancellation import Cancelled, CancellationToken
+from remote_capture import encode_frame, sample_rate, serve_recording, stream_to_server
+
+
+class LoopbackServer:
+    """Accepts one connection, reads the command line and serves the recording with transcribe."""
+    def __init__(self, transcribe, timeout=5):
+        self.token = CancellationToken()
+        self.listener = socket.create_server(('localhost', 0))
+        self.port = self.listener.getsockname()[1]
+        self.command = None
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self._serve, args=[transcribe, timeout], daemon=True)
+        self.thread.start()
+
+    def _serve(self, transcribe, timeout):
+        conn, _ = self.listener.accept()
+        with conn:
+            self.command = conn.recv(1024).decode()
+            try:
+                self.result = serve_recording(conn, self.token, transcribe, timeout)
+            except BaseException as e:
+                self.error = e
+
+    def join(self):
+        self.thread.join(5)
+        self.listener.close()
+        return self
+
+def blocks(seconds, delay=0.0):
+    for _ in range(int(seconds * 4)):
+        time.sleep(delay)
+        yield np.full(sample_rate // 4, 1000, dtype=np.int16)
+
+def test_returns_the_transcription():
+    received = []
+    server = LoopbackServer(lambda samples: received.append(samples) or 'hello world')
+    assert stream_to_server('localhost', server.port, ['--std-out'], blocks(1)) == 'hello world'
+    server.join()
+    assert '--remote-capture --std-out' in server.command
+    assert len(received[0]) == sample_rate and (received[0] == 1000).all()
+
+def test_failed_transcription_is_not_returned_as_text():
+    def fail(samples):
+        raise Exception('Traceback: the API is down')
+    server = LoopbackServer(fail)
+    with pytest.raises(Exception) as e:
+        stream_to_server('localhost', server.port, [], blocks(0.5))
+    assert 'Traceback' not in str(e.value)
+    assert 'API is down' in str(server.join().error)
+
+def test_abort_during_transcription():
+    def transcribe(samples):
+        server.token.wait(5)
+        server.token.raise_if_cancelled()
+        return 'too late'
+    server = LoopbackServer(transcribe)
+    threading.Timer(0.3, server.token.cancel).start()
+    with pytest.raises(Exception, match='Aborted'):
+        stream_to_server('localhost', server.port, [], blocks(0.5))
+    assert isinstance(server.join().error, Cancelled)
+
+def test_abort_during_recording_closes_the_connection():
+    server = LoopbackServer(lambda samples: 'too late')
+    threading.Timer(0.3, server.token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(Exception):
+        stream_to_server('localhost', server.port, [], blocks(5, delay=0.05))
+    assert time.monotonic() - start < 2
+    assert isinstance(server.join().error, Cancelled)
+
+def test_client_disconnect_during_recording():
+    server = LoopbackServer(lambda samples: 'never')
+    with socket.create_connection(('localhost', server.port)) as conn:
+        conn.sendall(b'--remote-capture')
+        assert conn.recv(6) == b'READY\n'
+        conn.sendall(encode_frame(np.zeros(sample_rate // 4, dtype=np.int16)))
+    assert isinstance(server.join().error, ConnectionError)
+
+def test_silent_client_times_out():
+    server = LoopbackServer(lambda samples: 'never', timeout=0.2)
+    with socket.create_connection(('localhost', server.port)) as conn:
+        conn.sendall(b'--remote-capture')
+        assert conn.recv(6) == b'READY\n'
+        assert conn.recv(1024) == b'ERR\n'
+    assert isinstance(server.join().error, TimeoutError)
@@ -0,0 +1,42 @@
+import os
+import time
+
+import numpy as np
+import soundfile as sf
+
+from retention import RetentionWorker
+
+rate = 16000
+day = 24 * 3600
+
+
+def policy(**changes):
+    return {'max_age_days': 30, 'recompress_after_hours': 24, 'recompress_bitrate': 16000,
+            'throttle_seconds': 0, 'max_megabytes': 100, **changes}
+
+def recording(audio_dir, name, age, seconds=1.0):
+    path = audio_dir / name
+    if seconds:
+        t = np.arange(int(rate * seconds)) / rate
+        sf.write(path, (0.1 * np.sin(2 * np.pi * 200 * t) * 32768).astype(np.int16), rate)
+    else:
+        path.write_bytes(b'')
+    os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+def test_recompresses_old_recordings(tmp_path):
+    recording(tmp_path, '2024_01_01-10_00_00.mp3', 2 * day)
+    recording(tmp_path, '2024_01_02-10_00_00.mp3', 60)
+    RetentionWorker(tmp_path, policy).apply()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['2024_01_01-10_00_00.ogg', '2024_01_02-10_00_00.mp3']
+
+def test_broken_recording_does_not_stop_the_policy(tmp_path):
+    recording(tmp_path, '2024_01_01-10_00_00.mp3', 2 * day, seconds=0)
+    recording(tmp_path, '2024_01_02-10_00_00.mp3', 2 * day)
+    worker = RetentionWorker(tmp_path, policy)
+    worker.apply()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['2024_01_01-10_00_00.mp3', '2024_01_02-10_00_00.ogg']
+    # The size budget still applies to all recordings.
+    worker.get_policy = lambda: policy(max_megabytes=0)
+    worker.apply()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,48 @@
+import threading
+from argparse import Namespace
+
+from cancellation import CancellationToken
+from sessions import SessionManager
+
+
+def args(start=False, stop=False, no_insertion=False):
+    return Namespace(start=start, stop=stop, std_out=False, no_insertion=no_insertion, only_record=False)
+
+def test_concurrent_toggles_start_one_session():
+    manager = SessionManager()
+    barrier = threading.Barrier(8)
+    results = []
+    def toggle():
+        barrier.wait()
+        results.append(manager.toggle(args(), CancellationToken()))
+    threads = [threading.Thread(target=toggle) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Toggles alternate between starting and stopping, so at most one session is left recording.
+    recording = [s for s in manager.sessions.values() if not s.stopped.is_set()]
+    assert recording == ([manager.recording] if manager.recording else [])
+    assert sum(started for _, started in results) == len(manager.sessions)
+
+def test_toggle_stops_the_recording_session():
+    manager = SessionManager()
+    session, started = manager.toggle(args(), CancellationToken())
+    assert started and manager.recording is session
+    assert manager.toggle(args(), CancellationToken()) == (session, False)
+    assert session.stopped.is_set() and manager.recording is None
+
+def test_start_and_stop_only_do_one_thing():
+    manager = SessionManager()
+    assert manager.toggle(args(stop=True), CancellationToken()) == (None, False)
+    session, _ = manager.toggle(args(start=True), CancellationToken())
+    assert manager.toggle(args(start=True), CancellationToken()) == (None, False)
+    assert manager.recording is session
+
+def test_sessions_without_insertion_dont_block_later_ones():
+    manager = SessionManager()
+    first, _ = manager.toggle(args(no_insertion=True), CancellationToken())
+    manager.toggle(args(), CancellationToken())
+    second, _ = manager.toggle(args(), CancellationToken())
+    manager.wait_for_turn(second)
+    assert first.seq in manager.sessions
@@ -0,0 +1,5 @@
+from benchmark_text_processing import check_golden, load_corpus
+
+
+def test_outputs_match_the_golden_file():
+    assert check_golden(load_corpus()) == 0
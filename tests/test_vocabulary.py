@@ -0,0 +1,40 @@
+import pytest
+
+from vocabulary import Vocabulary
+
+vocabulary = Vocabulary(['parse', 'Token', 'config', 'Kubernetes', 'PyTorch', 'system-wide-whisper',
+                         'Jane Doe', 'BK-tree', 'tokenizer'])
+
+
+@pytest.mark.parametrize('text', [
+    'The file is parsed.',
+    'It was taken yesterday.',
+    'Load both configs.',
+    'Parsing takes long.',
+    'Two tokenizers, one tokenized text.',
+])
+def test_keeps_ordinary_words(text):
+    assert vocabulary.correct(text) == text
+
+@pytest.mark.parametrize('text, expected', [
+    ('Deploy it on kubernetis.', 'Deploy it on Kubernetes.'),
+    ('Use py torch, then pytorch.', 'Use PyTorch, then PyTorch.'),
+    ('The system wide whisper repo', 'The system-wide-whisper repo'),
+    ('Ask jane doe about a bk tree', 'Ask Jane Doe about a BK-tree'),
+    ('A tokeniser splits.', 'A tokenizer splits.'),
+])
+def test_corrects_terms(text, expected):
+    assert vocabulary.correct(text) == expected
+
+def test_exact_match_fixes_capitalization_of_short_terms():
+    assert vocabulary.correct('one token') == 'one Token'
+
+@pytest.mark.parametrize('text', [
+    'I met Jane.\n\nDoe said hi.',
+    'I met Jane\n- Doe said hi.',
+    'Ask jane? Doe knows.',
+    'the system. Wide whisper',
+    'the system wide\nwhisper',
+])
+def test_terms_dont_span_sentences_or_lines(text):
+    assert vocabulary.correct(text) == text